@@ -7,7 +7,10 @@ class Settings(BaseSettings):
     openai_api_key: str
     
     # Database
-    database_url: str = "sqlite:///./sellmyshit.db"
+    database_url: str = "sqlite:///./sellmyshit.db"  # sqlite:// runs on aiosqlite
+    database_pool_size: int = 5
+    database_max_overflow: int = 10
+    database_busy_timeout: float = 30.0  # Seconds a write waits for the SQLite lock
     
     # Application
     app_env: str = "development"
@@ -22,11 +25,77 @@ class Settings(BaseSettings):
     def allowed_extensions_list(self) -> list[str]:
         return [ext.strip() for ext in self.allowed_image_extensions.split(',')]
     
+    # Item Analysis Cache (perceptual hash, persisted in SQLite)
+    analysis_cache_enabled: bool = True
+    analysis_cache_max_distance: int = 4  # Max Hamming distance between 64-bit hashes (0-7)
+    analysis_cache_ttl_hours: float = 168.0
+    analysis_cache_memory_size: int = 256
+    
+    # Generated Image Cache (stored next to enhanced/)
+    generation_cache_enabled: bool = True
+    generation_cache_dir: str = "generation_cache"
+    generation_cache_max_mb: int = 500
+    
+    # Request Coalescing (concurrent identical upstream calls share one request)
+    single_flight_enabled: bool = True
+    
+    # Background Jobs
+    job_workers: int = 2
+    job_queue_max_size: int = 100
+    
+    # Bulk Export (rows fetched per query while streaming)
+    export_chunk_size: int = 1000
+    
     # Model Versions
     openai_model: str = "gpt-4.1"  # Using GPT-4.1 model
+    openai_repair_model: str = "gpt-4.1-mini"  # Fixes replies that fail schema validation
+    
+    # OpenAI Client (one pooled async client per process)
+    openai_timeout: float = 120.0
+    openai_connect_timeout: float = 10.0
+    openai_max_retries: int = 2  # Retries by the shared scheduler (429, 5xx, connection errors)
+    openai_max_connections: int = 100
+    openai_max_keepalive_connections: int = 20
+    
+    # OpenAI Scheduler (process-wide budgets; keep at or below your account limits)
+    openai_requests_per_minute: int = 500
+    openai_tokens_per_minute: int = 200000
+    openai_retry_backoff_max: float = 30.0
+    
+    # Vision Input (images are downsized before being sent to the model)
+    vision_max_edge: int = 1024
+    vision_detail: str = "auto"  # low, high or auto
+    vision_format: str = "jpeg"  # jpeg or webp
+    vision_quality: int = 85
+    image_ref_store: str = "openai"  # openai (Files API), local (in-memory stand-in) or inline
     
     # BFL API Configuration
     bfl_api_base_url: str = "https://api.bfl.ai/v1"
+    bfl_model: str = "flux-kontext-pro"
+    
+    # BFL HTTP Pool (shared by submit, poll and download)
+    bfl_http2: bool = True
+    bfl_timeout: float = 300.0
+    bfl_connect_timeout: float = 10.0
+    bfl_max_connections: int = 50
+    bfl_max_keepalive_connections: int = 20
+    bfl_keepalive_expiry: float = 60.0
+    
+    # BFL Polling (one shared poller for all in-flight generations)
+    bfl_poll_initial_delay: float = 6.0  # First guess at generation time, refined as jobs finish
+    bfl_poll_min_interval: float = 0.5
+    bfl_poll_max_interval: float = 5.0
+    bfl_poll_backoff: float = 1.5
+    bfl_poll_jitter: float = 0.2
+    bfl_poll_timeout: float = 180.0
+    bfl_poll_concurrency: int = 10
+    
+    # BFL Concurrency (AIMD window shared by every generation in the process)
+    bfl_concurrency_initial: int = 4
+    bfl_concurrency_min: int = 1
+    bfl_concurrency_max: int = 24  # BFL's per-account active task limit
+    bfl_submit_latency_target: float = 5.0
+    bfl_submit_retries: int = 3
     
     # Web Scraping
     scrape_timeout: int = 30
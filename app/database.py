@@ -1,25 +1,145 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from app.config import settings
 from app.models import Base
 
-# Create engine
-engine = create_engine(
-    settings.database_url,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.database_url else {}
+
+def _async_database_url(url: str) -> str:
+    """Swap a plain sqlite:// URL onto the aiosqlite driver; other URLs must name an async driver."""
+    parsed = make_url(url)
+    if parsed.drivername == "sqlite":
+        parsed = parsed.set(drivername="sqlite+aiosqlite")
+    return parsed.render_as_string(hide_password=False)
+
+
+def _pool_options(url: str) -> dict:
+    """Pool settings for the engine.
+    
+    The pool class is explicit because older SQLAlchemy gives aiosqlite file
+    databases a NullPool, which rejects pool sizes. In-memory SQLite keeps
+    its single StaticPool connection (the data lives in that connection).
+    """
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        return {}
+    return {
+        "poolclass": AsyncAdaptedQueuePool,
+        "pool_size": settings.database_pool_size,
+        "max_overflow": settings.database_max_overflow
+    }
+
+
+# Create engine (pooled connections, I/O off the event loop)
+engine = create_async_engine(
+    _async_database_url(settings.database_url),
+    pool_pre_ping=True,
+    **_pool_options(settings.database_url)
 )
 
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine.sync_engine, "connect")
+    def _configure_sqlite(dbapi_connection, connection_record):
+        # WAL lets readers proceed while a write is in progress; writers wait
+        # for the lock instead of failing with "database is locked"
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.database_busy_timeout * 1000)}")
+        cursor.close()
+
 # Create session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+# Row counts maintained by triggers instead of count(*) on every request
+SQLITE_ROW_COUNT_DDL = [
+    """
+    INSERT INTO row_counts (table_name, count)
+    SELECT 'listings', (SELECT count(*) FROM listings)
+    WHERE NOT EXISTS (SELECT 1 FROM row_counts WHERE table_name = 'listings')
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS listings_count_insert AFTER INSERT ON listings
+    BEGIN
+        UPDATE row_counts SET count = count + 1 WHERE table_name = 'listings';
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS listings_count_delete AFTER DELETE ON listings
+    BEGIN
+        UPDATE row_counts SET count = count - 1 WHERE table_name = 'listings';
+    END
+    """
+]
+
+# Full-text index over listings (external content: the text lives in listings)
+SQLITE_SEARCH_TABLE_DDL = """
+    CREATE VIRTUAL TABLE listings_fts USING fts5(
+        item_name, listing_title, keywords, listing_description,
+        content='listings', content_rowid='id', tokenize='porter unicode61'
+    )
+"""
+
+SQLITE_SEARCH_TRIGGER_DDL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS listings_fts_insert AFTER INSERT ON listings
+    BEGIN
+        INSERT INTO listings_fts (rowid, item_name, listing_title, keywords, listing_description)
+        VALUES (new.id, new.item_name, new.listing_title, new.keywords, new.listing_description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS listings_fts_delete AFTER DELETE ON listings
+    BEGIN
+        INSERT INTO listings_fts (listings_fts, rowid, item_name, listing_title, keywords, listing_description)
+        VALUES ('delete', old.id, old.item_name, old.listing_title, old.keywords, old.listing_description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS listings_fts_update
+    AFTER UPDATE OF item_name, listing_title, keywords, listing_description ON listings
+    BEGIN
+        INSERT INTO listings_fts (listings_fts, rowid, item_name, listing_title, keywords, listing_description)
+        VALUES ('delete', old.id, old.item_name, old.listing_title, old.keywords, old.listing_description);
+        INSERT INTO listings_fts (rowid, item_name, listing_title, keywords, listing_description)
+        VALUES (new.id, new.item_name, new.listing_title, new.keywords, new.listing_description);
+    END
+    """
+]
+
+async def _create_search_index(conn):
+    exists = await conn.scalar(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'listings_fts'"
+    ))
+    if not exists:
+        await conn.exec_driver_sql(SQLITE_SEARCH_TABLE_DDL)
+        # Index listings saved before search existed
+        await conn.exec_driver_sql("INSERT INTO listings_fts (listings_fts) VALUES ('rebuild')")
+    for statement in SQLITE_SEARCH_TRIGGER_DDL:
+        await conn.exec_driver_sql(statement)
+
+def _create_missing_indexes(sync_conn):
+    # create_all skips indexes added to tables that already exist
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
 
 # Create tables
-def init_db():
-    Base.metadata.create_all(bind=engine)
+async def init_db():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_create_missing_indexes)
+        if engine.dialect.name == "sqlite":
+            for statement in SQLITE_ROW_COUNT_DDL:
+                await conn.exec_driver_sql(statement)
+            await _create_search_index(conn)
+
+# Release pooled connections (called on app shutdown)
+async def close_db():
+    await engine.dispose()
 
 # Dependency for FastAPI
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
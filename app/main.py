@@ -1,21 +1,33 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Form
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Form, Query, Request
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func, text, tuple_, type_coerce, String, DateTime
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer_group
 from typing import Optional, List, Dict, Any
 import os
 import json
+import html
+import base64
 import asyncio
 from datetime import datetime
 
-from app.database import init_db, get_db
-from app.models import Listing
+from app.config import settings
+from app.database import engine, init_db, close_db, get_db, SessionLocal
+from app.models import Listing, RowCount
 from services.image_enhancer import ImageEnhancer
 from services.item_analyzer import ItemAnalyzer
 from services.price_researcher import PriceResearcher
 from services.listing_generator import ListingGenerator
 from services.smart_image_generator import SmartImageGenerator
 from services.image_insights import ImageInsightsService
+from services.pipeline import Stage, StagePipeline
+from services.openai_client import close_shared_openai_client
+from services.image_refs import image_ref_scope, wait_for_image_releases
+from services.structured_output import parse_metrics
+from services.bfl_client import close_shared_http_client
+from services.job_queue import JobQueue, QueueFullError
+from services.listing_export import EXPORT_FORMATS, arrow_schema, ndjson_stream, csv_stream, parquet_stream
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -33,9 +45,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize database
-init_db()
-
 # Initialize services
 enhancer = ImageEnhancer()
 analyzer = ItemAnalyzer()
@@ -45,29 +54,272 @@ smart_generator = SmartImageGenerator()
 insights_service = ImageInsightsService()
 
 
+@app.on_event("startup")
+async def startup():
+    await init_db()
+    await job_queue.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop job workers and release pooled upstream connections."""
+    await job_queue.stop()
+    await wait_for_image_releases()
+    await close_shared_openai_client()
+    await close_shared_http_client()
+    await close_db()
+
+
 @app.get("/")
 async def root():
     return {
         "message": "Sell My Shit API",
         "endpoints": {
             "POST /process-item": "Process an item image and generate listing",
+            "GET /jobs/{job_id}": "Get status and result of an async process-item job",
             "POST /generate-images": "Generate multiple enhanced images",
+            "POST /generate-images/stream": "Generate enhanced images with server-sent progress events",
+            "POST /generate-listing/stream": "Stream listing text token by token as server-sent events",
             "GET /listing/{listing_id}": "Get listing details",
             "GET /listings": "Get all listings",
+            "GET /listings/search": "Full-text search over listings",
+            "GET /listings/export": "Stream all listings as NDJSON, CSV or Parquet",
             "GET /image/{image_path}": "Get enhanced image",
-            "GET /market-insights/{item_name}/{category}": "Get market insights"
+            "GET /market-insights/{item_name}/{category}": "Get market insights",
+            "GET /metrics/structured-output": "Parse failure rates of structured LLM replies per prompt"
+        }
+    }
+
+
+def _ai_price_data(item_analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """Price data from the estimate in the item analysis."""
+    # Use estimated price from OpenAI
+    estimated_price = float(item_analysis.get("estimated_price", 0))
+    return {
+        "sources": [],
+        "items_found": 1,
+        "avg_price": estimated_price,
+        "min_price": estimated_price,
+        "max_price": estimated_price,
+        "median_price": estimated_price,
+        "price_range": f"${item_analysis.get('estimated_price', 0)}",
+        "ai_estimated": True
+    }
+
+
+def _build_item_pipeline(
+    enhancement_mode: str,
+    prompts_list: Optional[List[str]],
+    one_shot: bool = False
+) -> StagePipeline:
+    """Declare the /process-item stages; independent ones run concurrently.
+    
+    With `one_shot` the analysis stage also drafts the listing in the same
+    model call, so the listing stage only post-processes it.
+    """
+    
+    async def analyze(image_data, emit):
+        # Publish name and category as soon as they stream in, so market
+        # insights can start while the rest of the analysis is generated
+        identity = {}
+        
+        def on_field(key, value):
+            if key in ("item_name", "category") and value:
+                identity[key] = str(value).strip()
+                if len(identity) == 2:
+                    emit("item_identity", dict(identity))
+        
+        if one_shot:
+            item_analysis, listing_draft = await analyzer.analyze_item_with_listing(image_data, on_field)
+        else:
+            item_analysis, listing_draft = await analyzer.analyze_item(image_data, on_field), None
+        return {
+            "item_analysis": item_analysis,
+            "listing_draft": listing_draft,
+            "item_identity": {
+                "item_name": item_analysis["item_name"],
+                "category": item_analysis["category"]
+            }
+        }
+    
+    async def clean_image(image_data):
+        # Background removal only needs the raw bytes, so start it right away
+        return await smart_generator.generate_clean_image(image_data)
+    
+    async def smart_images(image_data, item_analysis, clean_image):
+        portfolio = await smart_generator.generate_listing_portfolio(
+            image_data,
+            item_analysis,
+            enhancement_mode="smart",
+            clean_image=clean_image
+        )
+        return portfolio["generated_images"]
+    
+    async def custom_images(image_data):
+        portfolio = await smart_generator.generate_custom_images(
+            image_data,
+            prompts_list
+        )
+        return portfolio["generated_images"]
+    
+    async def quick_images(image_data):
+        # Just do background removal
+        enhanced_data, enhanced_path = await enhancer.enhance_image(
+            image_data, 
+            "background_removal"
+        )
+        return [{
+            "type": "background_removal",
+            "description": "Clean white background",
+            "path": enhanced_path,
+            "url": f"/image/{os.path.basename(enhanced_path)}"
+        }]
+    
+    async def estimate_price(item_analysis):
+        return _ai_price_data(item_analysis)
+    
+    async def market_insights(item_identity):
+        return await researcher.get_market_insights(
+            item_identity["item_name"],
+            item_identity["category"]
+        )
+    
+    async def listing(item_analysis, listing_draft, price_data, market_insights):
+        if listing_draft is not None:
+            # Drafted by the one-shot analysis call; no further LLM round trip
+            listing_content = generator.build_listing(
+                listing_draft, price_data, market_insights
+            )
+        else:
+            # One LLM generation, rendered locally for every platform
+            listing_content = await generator.generate_listing(
+                item_analysis, price_data, market_insights
+            )
+        return {
+            "listing_content": listing_content,
+            "platform_listings": listing_content["platform_versions"]
         }
+    
+    stages = [Stage("analysis", analyze, ["image_data"], ["item_analysis", "listing_draft"], emits=["item_identity"])]
+    
+    if enhancement_mode == "smart":
+        stages += [
+            Stage("clean_image", clean_image, ["image_data"], ["clean_image"]),
+            Stage("enhancement", smart_images, ["image_data", "item_analysis", "clean_image"], ["enhanced_images"]),
+        ]
+    elif enhancement_mode == "custom" and prompts_list:
+        stages.append(Stage("enhancement", custom_images, ["image_data"], ["enhanced_images"]))
+    else:  # quick mode
+        stages.append(Stage("enhancement", quick_images, ["image_data"], ["enhanced_images"]))
+    
+    stages += [
+        Stage("price_estimate", estimate_price, ["item_analysis"], ["price_data"]),
+        Stage("market_insights", market_insights, ["item_identity"], ["market_insights"]),
+        Stage("listing", listing, ["item_analysis", "listing_draft", "price_data", "market_insights"], ["listing_content", "platform_listings"]),
+    ]
+    
+    return StagePipeline(stages)
+
+
+async def _run_item_pipeline(
+    image_data: bytes,
+    filename: str,
+    enhancement_mode: str,
+    prompts_list: Optional[List[str]],
+    db: AsyncSession,
+    one_shot: bool = False
+) -> Dict[str, Any]:
+    """Run the full item pipeline, save the listing and build the response."""
+    
+    # Run analysis, enhancement, pricing and listing stages as a DAG,
+    # uploading the image for the LLM calls only once
+    async with image_ref_scope():
+        values, stage_timings = await _build_item_pipeline(
+            enhancement_mode, prompts_list, one_shot
+        ).run(image_data=image_data)
+    
+    item_analysis = values["item_analysis"]
+    enhanced_images = values["enhanced_images"]
+    price_data = values["price_data"]
+    market_insights = values["market_insights"]
+    listing_content = values["listing_content"]
+    platform_listings = values["platform_listings"]
+    image_insights = None
+    
+    # Save to database
+    db_listing = Listing(
+        item_name=item_analysis["item_name"],
+        category=item_analysis["category"],
+        brand=item_analysis.get("brand"),
+        model=None,  # Not extracted anymore
+        original_image_path=filename,
+        enhanced_image_path=enhanced_images[0]["path"] if enhanced_images else "",
+        condition=item_analysis["condition"],
+        key_features=item_analysis["key_features"],
+        color=None,  # Not extracted anymore
+        size=None,  # Not extracted anymore
+        material=None,  # Not extracted anymore
+        suggested_price=listing_content["suggested_price"],
+        min_price=price_data.get("min_price"),
+        max_price=price_data.get("max_price"),
+        avg_price=price_data.get("avg_price"),
+        listing_title=listing_content["title"],
+        listing_description=listing_content["description"],
+        keywords=",".join(listing_content["keywords"]),
+        analysis_data=item_analysis,
+        price_research_data=price_data
+    )
+    db.add(db_listing)
+    await db.commit()
+    
+    return {
+        "listing_id": db_listing.id,
+        "item_analysis": {
+            **item_analysis,
+            "potential_issues": item_analysis.get("potential_issues", [])
+        },
+        "price_data": {
+            **price_data,
+            "demand_level": market_insights.get("demand_level", "medium"),
+            "best_time_to_sell": market_insights.get("best_time_to_sell", "Anytime"),
+            "items_found": price_data.get("items_found", 0)
+        },
+        "market_insights": market_insights,
+        "image_insights": image_insights,
+        "listing": listing_content,
+        "platform_listings": platform_listings,
+        "enhanced_images": enhanced_images,
+        "enhancement_mode": enhancement_mode,
+        "one_shot": one_shot,
+        "stage_timings": stage_timings
     }
 
 
+# Background workers for async /process-item requests
+job_queue = JobQueue(
+    _run_item_pipeline,
+    SessionLocal,
+    workers=settings.job_workers,
+    max_pending=settings.job_queue_max_size
+)
+
+
 @app.post("/process-item")
 async def process_item(
     file: UploadFile = File(...),
     enhancement_mode: str = Form("quick"),
     custom_prompts: Optional[str] = Form(None),
-    db: Session = Depends(get_db)
+    async_mode: bool = Form(False),
+    one_shot: bool = Form(False),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Process an item image and generate a complete listing."""
+    """Process an item image and generate a complete listing.
+    
+    With async_mode the pipeline runs on a background worker and a job ID is
+    returned immediately; poll GET /jobs/{job_id} for the result.
+    With one_shot the item analysis, price estimate and listing text come
+    from a single multimodal model call.
+    """
     
     # Validate file
     if not file.content_type.startswith("image/"):
@@ -82,132 +334,39 @@ async def process_item(
         # Read image data
         image_data = await file.read()
         
-        # Step 1: Initial analysis
-        # Save temp image for analysis
-        temp_path = f"uploads/{file.filename}"
-        os.makedirs("uploads", exist_ok=True)
-        with open(temp_path, "wb") as f:
-            f.write(image_data)
-        
-        item_analysis = await analyzer.analyze_item(temp_path)
-        
-        # Step 2: Generate enhanced images based on mode
-        enhanced_images = []
-        image_insights = None
-        
-        if enhancement_mode == "smart":
-            # Generate smart images with marketing portfolio
-            portfolio = await smart_generator.generate_listing_portfolio(
-                image_data,
-                item_analysis,
-                enhancement_mode="smart"
-            )
-            enhanced_images = portfolio["generated_images"]
-            
-        elif enhancement_mode == "custom" and prompts_list:
-            # Generate custom images
-            portfolio = await smart_generator.generate_custom_images(
-                image_data,
-                prompts_list
-            )
-            enhanced_images = portfolio["generated_images"]
-            
-        else:  # quick mode
-            # Just do background removal
-            enhanced_data, enhanced_path = await enhancer.enhance_image(
-                image_data, 
-                "background_removal"
+        if async_mode:
+            job_id = await job_queue.submit(
+                "process_item",
+                params={
+                    "filename": file.filename,
+                    "enhancement_mode": enhancement_mode,
+                    "custom_prompts": prompts_list,
+                    "one_shot": one_shot
+                },
+                payload={
+                    "image_data": image_data,
+                    "filename": file.filename,
+                    "enhancement_mode": enhancement_mode,
+                    "prompts_list": prompts_list,
+                    "one_shot": one_shot
+                }
             )
-            enhanced_images = [{
-                "type": "background_removal",
-                "description": "Clean white background",
-                "path": enhanced_path,
-                "url": f"/image/{os.path.basename(enhanced_path)}"
-            }]
-        
-        # Step 3: Use estimated price from OpenAI
-        price_data = {
-            "sources": [],
-            "items_found": 1,
-            "avg_price": float(item_analysis.get("estimated_price", 0)),
-            "min_price": float(item_analysis.get("estimated_price", 0)),
-            "max_price": float(item_analysis.get("estimated_price", 0)),
-            "median_price": float(item_analysis.get("estimated_price", 0)),
-            "price_range": f"${item_analysis.get('estimated_price', 0)}",
-            "ai_estimated": True
-        }
-        
-        # Step 4: Get market insights
-        market_insights = await researcher.get_market_insights(
-            item_analysis["item_name"],
-            item_analysis["category"]
-        )
-        
-        # Step 5: Generate listing content for all platforms
-        listing_content = await generator.generate_listing(
-            item_analysis, price_data, market_insights
-        )
-        
-        # Generate platform-specific versions
-        platforms = ["ebay", "craigslist", "facebook"]
-        platform_listings = {}
-        
-        for platform in platforms:
-            platform_listing = await generator.generate_platform_listing(
-                item_analysis, price_data, market_insights, platform
+            return JSONResponse(
+                status_code=202,
+                content={
+                    "job_id": job_id,
+                    "status": "queued",
+                    "status_url": f"/jobs/{job_id}"
+                }
             )
-            platform_listings[platform] = platform_listing
         
-        # Save to database
-        db_listing = Listing(
-            item_name=item_analysis["item_name"],
-            category=item_analysis["category"],
-            brand=item_analysis.get("brand"),
-            model=None,  # Not extracted anymore
-            original_image_path=file.filename,
-            enhanced_image_path=enhanced_images[0]["path"] if enhanced_images else "",
-            condition=item_analysis["condition"],
-            key_features=item_analysis["key_features"],
-            color=None,  # Not extracted anymore
-            size=None,  # Not extracted anymore
-            material=None,  # Not extracted anymore
-            suggested_price=listing_content["suggested_price"],
-            min_price=price_data.get("min_price"),
-            max_price=price_data.get("max_price"),
-            avg_price=price_data.get("avg_price"),
-            listing_title=listing_content["title"],
-            listing_description=listing_content["description"],
-            keywords=",".join(listing_content["keywords"]),
-            analysis_data=item_analysis,
-            price_research_data=price_data
+        return await _run_item_pipeline(
+            image_data, file.filename, enhancement_mode, prompts_list, db,
+            one_shot=one_shot
         )
-        db.add(db_listing)
-        db.commit()
-        db.refresh(db_listing)
-        
-        # Clean up temp file
-        os.remove(temp_path)
-        
-        return {
-            "listing_id": db_listing.id,
-            "item_analysis": {
-                **item_analysis,
-                "potential_issues": item_analysis.get("potential_issues", [])
-            },
-            "price_data": {
-                **price_data,
-                "demand_level": market_insights.get("demand_level", "medium"),
-                "best_time_to_sell": market_insights.get("best_time_to_sell", "Anytime"),
-                "items_found": price_data.get("items_found", 0)
-            },
-            "market_insights": market_insights,
-            "image_insights": image_insights,
-            "listing": listing_content,
-            "platform_listings": platform_listings,
-            "enhanced_images": enhanced_images,
-            "enhancement_mode": enhancement_mode
-        }
         
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         import traceback
         error_detail = {
@@ -219,6 +378,56 @@ async def process_item(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get the status (and result, once finished) of a background job."""
+    job = await job_queue.get(job_id)
+    
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return job
+
+
+async def _generate_portfolio(
+    image_data: bytes,
+    filename: str,
+    mode: str,
+    prompts_list: Optional[List[str]],
+    analysis_data: Optional[Dict[str, Any]],
+    progress_callback=None
+) -> Dict[str, Any]:
+    """Generate enhanced images for /generate-images and its streaming variant."""
+    
+    # Generate images based on mode
+    if mode == "custom" and prompts_list:
+        return await smart_generator.generate_custom_images(
+            image_data,
+            prompts_list,
+            progress_callback=progress_callback
+        )
+    
+    # Analysis and prompt generation share one uploaded copy of the image
+    async with image_ref_scope():
+        # Need item analysis for smart mode
+        if not analysis_data:
+            if progress_callback:
+                progress_callback("stage", {"message": "Analyzing item..."})
+            
+            # Analyze the item first
+            analysis_data = await analyzer.analyze_item(image_data)
+            
+            if progress_callback:
+                progress_callback("analysis", analysis_data)
+        
+        return await smart_generator.generate_listing_portfolio(
+            image_data,
+            analysis_data,
+            enhancement_mode=mode,
+            progress_callback=progress_callback
+        )
+
+
 @app.post("/generate-images")
 async def generate_images(
     file: UploadFile = File(...),
@@ -239,34 +448,163 @@ async def generate_images(
         # Read image data
         image_data = await file.read()
         
-        # Generate images based on mode
-        if mode == "custom" and prompts_list:
-            portfolio = await smart_generator.generate_custom_images(
-                image_data,
-                prompts_list
-            )
-        else:
-            # Need item analysis for smart mode
-            if not analysis_data:
-                # Analyze the item first
-                temp_path = f"uploads/temp_{file.filename}"
-                os.makedirs("uploads", exist_ok=True)
-                with open(temp_path, "wb") as f:
-                    f.write(image_data)
+        return await _generate_portfolio(
+            image_data, file.filename, mode, prompts_list, analysis_data
+        )
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _sse_event(event: str, data: Any) -> str:
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _event_stream(request: Request, run) -> StreamingResponse:
+    """Stream the events reported by `run(report)` as server-sent events.
+    
+    `run` gets a `report(event, data)` callback; its result is sent in a final
+    "done" event (or a fatal "error" event if it raises). Keep-alive comments
+    go out every 15s, and closing the connection cancels `run`.
+    """
+    events: asyncio.Queue = asyncio.Queue()
+    
+    def report(event: str, data: Any):
+        events.put_nowait((event, data))
+    
+    async def stream():
+        task = asyncio.create_task(run(report))
+        # Wake the stream up once the work is finished
+        task.add_done_callback(lambda _: events.put_nowait(None))
+        
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(events.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
                 
-                analysis_data = await analyzer.analyze_item(temp_path)
-                os.remove(temp_path)
+                if item is None:
+                    break
+                yield _sse_event(*item)
             
-            portfolio = await smart_generator.generate_listing_portfolio(
-                image_data,
-                analysis_data,
-                enhancement_mode=mode
-            )
+            if task.exception():
+                yield _sse_event("error", {"message": str(task.exception()), "fatal": True})
+            else:
+                yield _sse_event("done", task.result())
+        finally:
+            # Client went away (or we finished): stop upstream work early
+            if not task.done():
+                task.cancel()
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/generate-images/stream")
+async def generate_images_stream(
+    request: Request,
+    file: UploadFile = File(...),
+    mode: str = Form("smart"),
+    custom_prompts: Optional[str] = Form(None),
+    item_analysis: Optional[str] = Form(None)
+):
+    """Generate enhanced images, streaming progress as server-sent events.
+    
+    Emits "stage", "analysis", "image" (one per image, as soon as it is saved)
+    and "error" events, then a final "done" event with the whole portfolio.
+    Closing the connection cancels any generations still in flight.
+    """
+    
+    if not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    
+    try:
+        # Parse inputs
+        prompts_list = json.loads(custom_prompts) if custom_prompts else None
+        analysis_data = json.loads(item_analysis) if item_analysis else None
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Read image data
+    image_data = await file.read()
+    
+    return _event_stream(request, lambda report: _generate_portfolio(
+        image_data, file.filename, mode, prompts_list, analysis_data,
+        progress_callback=report
+    ))
+
+
+@app.post("/generate-listing/stream")
+async def generate_listing_stream(
+    request: Request,
+    file: Optional[UploadFile] = File(None),
+    item_analysis: Optional[str] = Form(None)
+):
+    """Generate listing text, streaming it token by token as server-sent events.
+    
+    Needs an image or a previous item analysis. Emits "stage" and "analysis"
+    events, then "delta" events ({"field", "text"}) carrying the title and
+    description text as it is generated and a "section" event as each of
+    title, description and keywords completes. The final "done" event has the
+    full listing with platform versions.
+    """
+    
+    if file is None and not item_analysis:
+        raise HTTPException(status_code=400, detail="Send an image or an item analysis")
+    if file is not None and not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    
+    try:
+        analysis_data = json.loads(item_analysis) if item_analysis else None
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    image_data = await file.read() if file is not None else None
+    
+    async def run(report):
+        nonlocal analysis_data
+        if not analysis_data:
+            report("stage", {"message": "Analyzing item..."})
+            analysis_data = await analyzer.analyze_item(image_data)
+            report("analysis", analysis_data)
         
-        return portfolio
+        price_data = _ai_price_data(analysis_data)
+        market_insights = await researcher.get_market_insights(
+            analysis_data["item_name"],
+            analysis_data["category"]
+        )
         
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        report("stage", {"message": "Writing listing..."})
+        sent: Dict[str, int] = {}
+        
+        def on_partial(key, text):
+            # Forward only the text added since the last event for this field
+            if len(text) > sent.get(key, 0):
+                report("delta", {"field": key, "text": text[sent.get(key, 0):]})
+                sent[key] = len(text)
+        
+        def on_field(key, value):
+            report("section", {"field": key, "value": value})
+        
+        listing_content = await generator.generate_listing(
+            analysis_data, price_data, market_insights,
+            on_field=on_field, on_partial=on_partial
+        )
+        return {
+            "item_analysis": analysis_data,
+            "price_data": price_data,
+            "listing": listing_content
+        }
+    
+    return _event_stream(request, run)
 
 
 @app.get("/market-insights/{item_name}/{category}")
@@ -279,51 +617,136 @@ async def get_market_insights(item_name: str, category: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/metrics/structured-output")
+async def get_structured_output_metrics():
+    """Per-prompt counts of LLM replies parsed, repaired and lost."""
+    return parse_metrics.snapshot()
+
+
+# Fields of GET /listing/{id} and the column each one is read from
+_LISTING_FIELDS = {
+    "id": Listing.id,
+    "item_name": Listing.item_name,
+    "category": Listing.category,
+    "brand": Listing.brand,
+    "model": Listing.model,
+    "condition": Listing.condition,
+    "color": Listing.color,
+    "size": Listing.size,
+    "material": Listing.material,
+    "suggested_price": Listing.suggested_price,
+    "min_price": Listing.min_price,
+    "max_price": Listing.max_price,
+    "avg_price": Listing.avg_price,
+    "title": Listing.listing_title,
+    "description": Listing.listing_description,
+    "keywords": Listing.keywords,
+    "key_features": Listing.key_features,
+    "created_at": Listing.created_at,
+    "enhanced_image_url": Listing.enhanced_image_path,
+    "analysis_data": Listing.analysis_data,
+    "price_research_data": Listing.price_research_data
+}
+
+
+def _listing_field(name: str, value: Any) -> Any:
+    """Convert a stored column value to its API form."""
+    if name == "keywords":
+        return value.split(",") if value else []
+    if name == "enhanced_image_url":
+        return f"/image/{os.path.basename(value)}" if value else None
+    return value
+
+
+def _listing_field_names(fields: Optional[str]) -> List[str]:
+    """Field names from a comma-separated `fields` parameter (all fields if empty)."""
+    if not fields:
+        return list(_LISTING_FIELDS)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    if not names:
+        raise HTTPException(status_code=400, detail="fields must name at least one field")
+    unknown = [name for name in names if name not in _LISTING_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return names
+
+
 @app.get("/listing/{listing_id}")
-async def get_listing(listing_id: int, db: Session = Depends(get_db)):
-    """Get listing details by ID."""
-    listing = db.query(Listing).filter(Listing.id == listing_id).first()
+async def get_listing(listing_id: int, fields: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    """Get listing details by ID.
     
-    if not listing:
+    `fields` is an optional comma-separated subset of the response fields
+    (e.g. `?fields=title,suggested_price`); only those columns are read.
+    """
+    names = _listing_field_names(fields)
+    row = (await db.execute(
+        select(*[_LISTING_FIELDS[name].label(name) for name in names]).where(Listing.id == listing_id)
+    )).first()
+    
+    if not row:
         raise HTTPException(status_code=404, detail="Listing not found")
     
-    return {
-        "id": listing.id,
-        "item_name": listing.item_name,
-        "category": listing.category,
-        "brand": listing.brand,
-        "model": listing.model,
-        "condition": listing.condition,
-        "color": listing.color,
-        "size": listing.size,
-        "material": listing.material,
-        "suggested_price": listing.suggested_price,
-        "min_price": listing.min_price,
-        "max_price": listing.max_price,
-        "avg_price": listing.avg_price,
-        "title": listing.listing_title,
-        "description": listing.listing_description,
-        "keywords": listing.keywords.split(",") if listing.keywords else [],
-        "key_features": listing.key_features,
-        "created_at": listing.created_at,
-        "enhanced_image_url": f"/image/{os.path.basename(listing.enhanced_image_path)}" if listing.enhanced_image_path else None,
-        "analysis_data": listing.analysis_data,
-        "price_research_data": listing.price_research_data
-    }
+    return {name: _listing_field(name, row._mapping[name]) for name in names}
+
+
+def _encode_cursor(created_at: str, listing_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, listing_id]).encode()).decode()
+
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at, listing_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(created_at), int(listing_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 
 @app.get("/listings")
 async def get_listings(
     skip: int = 0,
-    limit: int = 10,
-    db: Session = Depends(get_db)
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get all listings with pagination."""
-    listings = db.query(Listing).order_by(Listing.created_at.desc()).offset(skip).limit(limit).all()
-    total = db.query(Listing).count()
+    """Get listings newest first.
+    
+    Pass the `next_cursor` of one page as `cursor` to get the next; each page
+    is an index range scan on (created_at, id), so deep pages cost the same
+    as the first. `skip` (offset paging) is still accepted but gets slower
+    the deeper it goes.
+    """
+    # Compare created_at as stored so cursors round-trip exactly
+    created_at_raw = type_coerce(Listing.created_at, String)
+    query = select(
+        Listing.id,
+        Listing.item_name,
+        Listing.category,
+        Listing.suggested_price,
+        Listing.created_at,
+        Listing.enhanced_image_path,
+        created_at_raw.label("created_at_raw")
+    ).order_by(
+        Listing.created_at.desc(), Listing.id.desc()
+    )
+    if cursor:
+        query = query.where(tuple_(created_at_raw, Listing.id) < _decode_cursor(cursor))
+    elif skip:
+        query = query.offset(skip)
+    # One extra row tells us whether there is a next page
+    rows = (await db.execute(query.limit(limit + 1))).all()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1].created_at_raw, rows[-1].id)
+    
+    total = await db.scalar(select(RowCount.count).where(RowCount.table_name == "listings"))
+    if total is None:
+        total = await db.scalar(select(func.count()).select_from(Listing))
     
     return {
         "total": total,
+        "next_cursor": next_cursor,
         "listings": [
             {
                 "id": l.id,
@@ -331,13 +754,166 @@ async def get_listings(
                 "category": l.category,
                 "suggested_price": l.suggested_price,
                 "created_at": l.created_at,
-                "enhanced_image_url": f"/image/{os.path.basename(l.enhanced_image_path)}"
+                "enhanced_image_url": _listing_field("enhanced_image_url", l.enhanced_image_path)
             }
-            for l in listings
+            for l in rows
         ]
     }
 
 
+def _fts_query(q: str) -> str:
+    """Turn free text into an FTS5 query: every term must match, the last one as a prefix."""
+    terms = ['"' + term.replace('"', '""') + '"' for term in q.split()]
+    if not terms:
+        return ""
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+# snippet() wraps matches in these; listing text is escaped before they become <mark> tags
+_SNIPPET_MARK_START = "\x02"
+_SNIPPET_MARK_END = "\x03"
+
+
+def _snippet_html(snippet: Optional[str]) -> Optional[str]:
+    """HTML-safe snippet: the listing text escaped, matched terms in <mark> tags."""
+    if snippet is None:
+        return None
+    return (html.escape(snippet)
+            .replace(_SNIPPET_MARK_START, "<mark>")
+            .replace(_SNIPPET_MARK_END, "</mark>"))
+
+
+@app.get("/listings/search")
+async def search_listings(
+    q: str,
+    category: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db)
+):
+    """Full-text search over item names, titles, keywords and descriptions.
+    
+    Results are ranked by BM25 (title and item name matches weigh most) and
+    carry an HTML snippet (listing text escaped, matched terms in <mark>
+    tags). Optionally
+    filtered by category and suggested price range.
+    """
+    if engine.dialect.name != "sqlite":
+        raise HTTPException(status_code=501, detail="Search requires the SQLite FTS5 index")
+    
+    match = _fts_query(q)
+    if not match:
+        raise HTTPException(status_code=400, detail="Query must contain at least one term")
+    
+    params = {"match": match, "limit": limit,
+              "mark_start": _SNIPPET_MARK_START, "mark_end": _SNIPPET_MARK_END}
+    filters = ""
+    if category:
+        filters += " AND l.category = :category COLLATE NOCASE"
+        params["category"] = category
+    if min_price is not None:
+        filters += " AND l.suggested_price >= :min_price"
+        params["min_price"] = min_price
+    if max_price is not None:
+        filters += " AND l.suggested_price <= :max_price"
+        params["max_price"] = max_price
+    
+    # bm25 weights follow the column order: item_name, listing_title, keywords, listing_description
+    query = text(f"""
+        SELECT l.id, l.item_name, l.category, l.suggested_price, l.created_at, l.enhanced_image_path,
+               snippet(listings_fts, -1, :mark_start, :mark_end, '...', 16) AS snippet,
+               bm25(listings_fts, 5.0, 10.0, 3.0, 1.0) AS score
+        FROM listings_fts
+        JOIN listings l ON l.id = listings_fts.rowid
+        WHERE listings_fts MATCH :match{filters}
+        ORDER BY score
+        LIMIT :limit
+    """).columns(created_at=DateTime)
+    rows = (await db.execute(query, params)).all()
+    
+    return {
+        "query": q,
+        "results": [
+            {
+                "id": r.id,
+                "item_name": r.item_name,
+                "category": r.category,
+                "suggested_price": r.suggested_price,
+                "created_at": r.created_at,
+                "enhanced_image_url": _listing_field("enhanced_image_url", r.enhanced_image_path),
+                "snippet": _snippet_html(r.snippet),
+                "score": -r.score  # bm25() is lower-is-better; flip so higher is better
+            }
+            for r in rows
+        ]
+    }
+
+
+async def _export_chunks(names: List[str], filters: List[Any]):
+    """Yield matching listings in id order, one short query per chunk."""
+    columns = [_LISTING_FIELDS[name].label(name) for name in names]
+    last_id = 0
+    while True:
+        async with SessionLocal() as db:
+            rows = (await db.execute(
+                select(Listing.id.label("cursor_id"), *columns)
+                .where(Listing.id > last_id, *filters)
+                .order_by(Listing.id)
+                .limit(settings.export_chunk_size)
+            )).all()
+        if not rows:
+            return
+        yield [{name: _listing_field(name, row._mapping[name]) for name in names} for row in rows]
+        if len(rows) < settings.export_chunk_size:
+            return
+        last_id = rows[-1].cursor_id
+
+
+@app.get("/listings/export")
+async def export_listings(
+    format: str = "ndjson",
+    fields: Optional[str] = None,
+    category: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None
+):
+    """Stream every listing (or those matching the filters) as NDJSON, CSV or Parquet.
+    
+    Rows are read in chunks of EXPORT_CHUNK_SIZE and written out as they
+    arrive, so memory use doesn't grow with the table. `fields` selects
+    columns as in GET /listing/{id}; in CSV and Parquet, list and JSON
+    values are written as JSON strings.
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    names = _listing_field_names(fields)
+    
+    filters = []
+    if category:
+        filters.append(Listing.category.collate("NOCASE") == category)
+    if min_price is not None:
+        filters.append(Listing.suggested_price >= min_price)
+    if max_price is not None:
+        filters.append(Listing.suggested_price <= max_price)
+    
+    chunks = _export_chunks(names, filters)
+    if format == "ndjson":
+        body = ndjson_stream(chunks)
+    elif format == "csv":
+        body = csv_stream(chunks, names)
+    else:
+        body = parquet_stream(chunks, arrow_schema({name: _LISTING_FIELDS[name].type for name in names}))
+    
+    media_type, extension = EXPORT_FORMATS[format]
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=listings.{extension}"}
+    )
+
+
 @app.get("/image/{filename}")
 async def get_image(filename: str):
     """Serve enhanced images."""
@@ -362,8 +938,9 @@ async def generate_variations(
         # Read image data
         image_data = await file.read()
         
-        # Generate variations
-        result = await smart_generator.generate_variations(image_data)
+        # Generate variations; the three prompt calls reference one upload
+        async with image_ref_scope():
+            result = await smart_generator.generate_variations(image_data)
         
         return {
             "success": True,
@@ -385,9 +962,9 @@ async def generate_variations(
 
 
 @app.get("/download-listing/{listing_id}")
-async def download_listing(listing_id: int, db: Session = Depends(get_db)):
+async def download_listing(listing_id: int, db: AsyncSession = Depends(get_db)):
     """Download listing data as JSON."""
-    listing = db.query(Listing).filter(Listing.id == listing_id).first()
+    listing = await db.get(Listing, listing_id, options=[undefer_group("details")])
     
     if not listing:
         raise HTTPException(status_code=404, detail="Listing not found")
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text, JSON
+from sqlalchemy import Column, Integer, String, Float, DateTime, Text, JSON, Index
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
 from datetime import datetime
 
@@ -9,6 +10,9 @@ Base = declarative_base()
 class Listing(Base):
     __tablename__ = "listings"
     
+    # Heavy text/JSON columns are in the deferred "details" group: loading a
+    # Listing skips them unless the query uses undefer_group("details")
+    
     id = Column(Integer, primary_key=True, index=True)
     
     # Item identification
@@ -23,7 +27,7 @@ class Listing(Base):
     
     # Analysis results
     condition = Column(String(50))
-    key_features = Column(JSON)  # Store as JSON array
+    key_features = deferred(Column(JSON), group="details", raiseload=True)  # Store as JSON array
     color = Column(String(50))
     size = Column(String(50))
     material = Column(String(100))
@@ -36,7 +40,7 @@ class Listing(Base):
     
     # Generated content
     listing_title = Column(String(255))
-    listing_description = Column(Text)
+    listing_description = deferred(Column(Text), group="details", raiseload=True)
     keywords = Column(Text)  # Comma-separated
     
     # Metadata
@@ -44,8 +48,13 @@ class Listing(Base):
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     
     # Additional analysis data
-    analysis_data = Column(JSON)  # Store complete analysis results
-    price_research_data = Column(JSON)  # Store price research details
+    analysis_data = deferred(Column(JSON), group="details", raiseload=True)  # Store complete analysis results
+    price_research_data = deferred(Column(JSON), group="details", raiseload=True)  # Store price research details
+    
+    __table_args__ = (
+        # Newest-first keyset pagination walks this index
+        Index("ix_listings_created_at_id", "created_at", "id"),
+    )
 
 
 class PriceResearch(Base):
@@ -60,4 +69,50 @@ class PriceResearch(Base):
     condition = Column(String(50))
     url = Column(String(1000))
     
-    created_at = Column(DateTime, default=func.now())
\ No newline at end of file
+    created_at = Column(DateTime, default=func.now())
+
+class Job(Base):
+    __tablename__ = "jobs"
+    
+    id = Column(String(36), primary_key=True)  # UUID handed to the client
+    kind = Column(String(50))  # e.g. process_item
+    status = Column(String(20), index=True)  # queued, running, succeeded, failed
+    
+    params = Column(JSON)  # Request options (never the upload itself)
+    result = Column(JSON)  # Full response once succeeded
+    error = Column(Text)
+    
+    created_at = Column(DateTime, default=func.now())
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+
+class AnalysisCacheEntry(Base):
+    __tablename__ = "analysis_cache"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    
+    # 64-bit perceptual hash as hex, split into 8-bit bands for near-match lookup
+    phash = Column(String(16), nullable=False)
+    band_0 = Column(Integer, index=True)
+    band_1 = Column(Integer, index=True)
+    band_2 = Column(Integer, index=True)
+    band_3 = Column(Integer, index=True)
+    band_4 = Column(Integer, index=True)
+    band_5 = Column(Integer, index=True)
+    band_6 = Column(Integer, index=True)
+    band_7 = Column(Integer, index=True)
+    
+    model = Column(String(100))  # Vision model that produced the analysis
+    analysis = Column(JSON)
+    
+    created_at = Column(DateTime, default=func.now())
+    expires_at = Column(DateTime, index=True)
+
+
+class RowCount(Base):
+    __tablename__ = "row_counts"
+    
+    # Kept current by triggers (see app/database.py) so totals never need count(*)
+    table_name = Column(String(100), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
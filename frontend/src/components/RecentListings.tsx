@@ -15,6 +15,8 @@ const RecentListings: React.FC<RecentListingsProps> = ({ isOpen, onClose, onSele
   const [loading, setLoading] = useState(false);
   const [currentPage, setCurrentPage] = useState(0);
   const [totalListings, setTotalListings] = useState(0);
+  // cursors[n] fetches page n; filled in from each page's next_cursor
+  const [cursors, setCursors] = useState<(string | null)[]>([null]);
   const itemsPerPage = 5;
 
   useEffect(() => {
@@ -26,9 +28,14 @@ const RecentListings: React.FC<RecentListingsProps> = ({ isOpen, onClose, onSele
   const fetchListings = async () => {
     setLoading(true);
     try {
-      const response = await getListings(currentPage * itemsPerPage, itemsPerPage);
+      const response = await getListings(cursors[currentPage] ?? null, itemsPerPage);
       setListings(response.listings);
       setTotalListings(response.total);
+      setCursors((previous) => {
+        const next = previous.slice(0, currentPage + 1);
+        next[currentPage + 1] = response.next_cursor;
+        return next;
+      });
     } catch (error) {
       console.error('Error fetching listings:', error);
       toast.error('Failed to load recent listings');
@@ -169,10 +176,10 @@ const RecentListings: React.FC<RecentListingsProps> = ({ isOpen, onClose, onSele
 
                   <button
                     onClick={() => setCurrentPage(Math.min(totalPages - 1, currentPage + 1))}
-                    disabled={currentPage === totalPages - 1 || loading}
+                    disabled={currentPage === totalPages - 1 || !cursors[currentPage + 1] || loading}
                     className={`
                       p-2 rounded-lg transition-all duration-200
-                      ${currentPage === totalPages - 1 || loading
+                      ${currentPage === totalPages - 1 || !cursors[currentPage + 1] || loading
                         ? 'bg-gray-800 text-gray-600 cursor-not-allowed'
                         : 'bg-cyber-purple/20 text-cyber-purple hover:bg-cyber-purple/30'
                       }
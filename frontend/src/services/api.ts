@@ -100,6 +100,7 @@ export interface ListingSummary {
 
 export interface ListingsResponse {
   total: number;
+  next_cursor: string | null;
   listings: ListingSummary[];
 }
 
@@ -164,8 +165,10 @@ export const getListing = async (listingId: number) => {
   return response.data;
 };
 
-export const getListings = async (skip: number = 0, limit: number = 10): Promise<ListingsResponse> => {
-  const response = await api.get<ListingsResponse>(`/listings?skip=${skip}&limit=${limit}`);
+export const getListings = async (cursor: string | null = null, limit: number = 10): Promise<ListingsResponse> => {
+  const response = await api.get<ListingsResponse>('/listings', {
+    params: cursor ? { cursor, limit } : { limit },
+  });
   return response.data;
 };
 
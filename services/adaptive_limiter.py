@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+
+class AdaptiveLimiter:
+    """Sliding concurrency window sized AIMD-style from upstream feedback.
+
+    Callers hold a slot for as long as the upstream counts their work as
+    active. Fast successes grow the window by roughly one slot per window's
+    worth of requests; throttling (429/5xx) halves it, and slow responses
+    shrink it gently.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, latency_target: float):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.window = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self._cond = asyncio.Condition()
+        self._last_decrease = 0.0
+
+    @property
+    def limit(self) -> int:
+        return max(self.minimum, int(self.window))
+
+    async def acquire(self):
+        """Wait for a free slot in the current window."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    async def record_success(self, latency: float):
+        """Additive increase on fast responses, gentle decrease on slow ones."""
+        async with self._cond:
+            if latency <= self.latency_target:
+                self.window = min(self.maximum, self.window + 1.0 / self.window)
+            else:
+                self.window = max(self.minimum, self.window * 0.9)
+            self._cond.notify_all()
+
+    async def record_congestion(self):
+        """Multiplicative decrease on 429/5xx, at most once per latency target.
+
+        A burst of rejections from the same overload only halves the window once.
+        """
+        now = time.monotonic()
+        if now - self._last_decrease < self.latency_target:
+            return
+        self._last_decrease = now
+        self.window = max(self.minimum, self.window / 2)
+        print(f"[DEBUG] Upstream congestion, concurrency window now {self.window:.1f}")
@@ -0,0 +1,147 @@
+import asyncio
+import copy
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from io import BytesIO
+from typing import Dict, Any, Optional, Callable, Tuple
+from PIL import Image, ImageOps
+from sqlalchemy import select, delete, or_
+from app.config import settings
+from app.database import SessionLocal
+from app.models import AnalysisCacheEntry
+
+NUM_BANDS = 8
+BAND_BITS = 64 // NUM_BANDS
+
+
+def perceptual_hash(image_data: bytes) -> int:
+    """64-bit difference hash: survives re-encoding, resizing and small edits."""
+    img = ImageOps.exif_transpose(Image.open(BytesIO(image_data)))
+    img = img.convert("L").resize((9, 8), Image.Resampling.LANCZOS)
+    pixels = list(img.getdata())
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def _bands(phash: int) -> list:
+    mask = (1 << BAND_BITS) - 1
+    return [(phash >> (i * BAND_BITS)) & mask for i in range(NUM_BANDS)]
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class AnalysisCache:
+    """Caches vision analyses by perceptual hash, so near-identical uploads hit.
+
+    A small in-memory LRU sits in front of the `analysis_cache` table. Lookups
+    in SQLite use band indexes: two hashes within `max_distance` bits
+    (max_distance < 8) must share at least one 8-bit band exactly, so only
+    rows matching a band are compared.
+    """
+
+    def __init__(self,
+                 session_factory: Callable,
+                 model: str,
+                 max_distance: int,
+                 ttl_hours: float,
+                 memory_size: int):
+        self.session_factory = session_factory
+        self.model = model
+        self.max_distance = min(max_distance, NUM_BANDS - 1)
+        self.ttl = timedelta(hours=ttl_hours)
+        self.memory_size = memory_size
+        self._memory: "OrderedDict[int, Tuple[Dict[str, Any], datetime]]" = OrderedDict()
+
+    async def get(self, image_data: bytes) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """Return (phash, analysis), with analysis None on a miss."""
+        phash = await asyncio.to_thread(perceptual_hash, image_data)
+        now = datetime.utcnow()
+
+        for cached_hash, (analysis, expires_at) in list(self._memory.items()):
+            if expires_at <= now:
+                del self._memory[cached_hash]
+            elif hamming_distance(cached_hash, phash) <= self.max_distance:
+                self._memory.move_to_end(cached_hash)
+                return phash, copy.deepcopy(analysis)
+
+        match = await self._lookup(phash, now)
+        if match is None:
+            return phash, None
+
+        cached_hash, analysis, expires_at = match
+        self._remember(cached_hash, analysis, expires_at)
+        return phash, copy.deepcopy(analysis)
+
+    async def put(self, phash: int, analysis: Dict[str, Any]):
+        expires_at = datetime.utcnow() + self.ttl
+        self._remember(phash, copy.deepcopy(analysis), expires_at)
+        await self._store(phash, analysis, expires_at)
+
+    def _remember(self, phash: int, analysis: Dict[str, Any], expires_at: datetime):
+        self._memory[phash] = (analysis, expires_at)
+        self._memory.move_to_end(phash)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    async def _lookup(self, phash: int, now: datetime):
+        async with self.session_factory() as db:
+            band_columns = [getattr(AnalysisCacheEntry, f"band_{i}") for i in range(NUM_BANDS)]
+            candidates = (await db.execute(
+                select(AnalysisCacheEntry.phash, AnalysisCacheEntry.analysis, AnalysisCacheEntry.expires_at).where(
+                    AnalysisCacheEntry.model == self.model,
+                    AnalysisCacheEntry.expires_at > now,
+                    or_(*[column == band for column, band in zip(band_columns, _bands(phash))])
+                )
+            )).all()
+
+            best = None
+            for entry in candidates:
+                distance = hamming_distance(int(entry.phash, 16), phash)
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, entry)
+
+            if best is None:
+                return None
+            entry = best[1]
+            return int(entry.phash, 16), entry.analysis, entry.expires_at
+
+    async def _store(self, phash: int, analysis: Dict[str, Any], expires_at: datetime):
+        async with self.session_factory() as db:
+            # Opportunistically drop expired rows
+            await db.execute(delete(AnalysisCacheEntry).where(
+                AnalysisCacheEntry.expires_at <= datetime.utcnow()
+            ))
+
+            bands = {f"band_{i}": band for i, band in enumerate(_bands(phash))}
+            db.add(AnalysisCacheEntry(
+                phash=f"{phash:016x}",
+                model=self.model,
+                analysis=analysis,
+                expires_at=expires_at,
+                **bands
+            ))
+            await db.commit()
+
+_shared_cache: Optional[AnalysisCache] = None
+
+
+def get_shared_analysis_cache() -> Optional[AnalysisCache]:
+    """Return the process-wide analysis cache, or None if disabled."""
+    global _shared_cache
+    if _shared_cache is None and settings.analysis_cache_enabled:
+        _shared_cache = AnalysisCache(
+            SessionLocal,
+            model=settings.openai_model,
+            max_distance=settings.analysis_cache_max_distance,
+            ttl_hours=settings.analysis_cache_ttl_hours,
+            memory_size=settings.analysis_cache_memory_size
+        )
+    return _shared_cache
@@ -1,13 +1,109 @@
 import httpx
 import asyncio
 import base64
-from typing import Dict, Any, Optional, List, Tuple
+import hashlib
+import random
+import time
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, List, Tuple, Union
 from io import BytesIO
 from PIL import Image
 import json
 import uuid
 import os
 from app.config import settings
+from services.bfl_poller import BFLPoller
+from services.adaptive_limiter import AdaptiveLimiter
+from services.generation_cache import GenerationCache
+from services.single_flight import SingleFlight, fingerprint
+
+
+_shared_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_shared_http_client() -> httpx.AsyncClient:
+    """Return the process-wide pooled HTTP/2 client used for all BFL traffic."""
+    global _shared_http_client
+    if _shared_http_client is None:
+        _shared_http_client = httpx.AsyncClient(
+            http2=settings.bfl_http2,
+            timeout=httpx.Timeout(settings.bfl_timeout, connect=settings.bfl_connect_timeout),
+            limits=httpx.Limits(
+                max_connections=settings.bfl_max_connections,
+                max_keepalive_connections=settings.bfl_max_keepalive_connections,
+                keepalive_expiry=settings.bfl_keepalive_expiry
+            )
+        )
+    return _shared_http_client
+
+
+_shared_poller: Optional[BFLPoller] = None
+
+
+def get_shared_poller() -> BFLPoller:
+    """Return the process-wide poller tracking every in-flight BFL request."""
+    global _shared_poller
+    if _shared_poller is None:
+        _shared_poller = BFLPoller(get_shared_http_client)
+    return _shared_poller
+
+
+_shared_limiter: Optional[AdaptiveLimiter] = None
+
+
+def get_shared_limiter() -> AdaptiveLimiter:
+    """Return the process-wide concurrency window for BFL generations."""
+    global _shared_limiter
+    if _shared_limiter is None:
+        _shared_limiter = AdaptiveLimiter(
+            initial=settings.bfl_concurrency_initial,
+            minimum=settings.bfl_concurrency_min,
+            maximum=settings.bfl_concurrency_max,
+            latency_target=settings.bfl_submit_latency_target
+        )
+    return _shared_limiter
+
+
+_shared_cache: Optional[GenerationCache] = None
+
+
+def get_shared_cache() -> Optional[GenerationCache]:
+    """Return the process-wide generated-image cache, or None if disabled."""
+    global _shared_cache
+    if _shared_cache is None and settings.generation_cache_enabled:
+        _shared_cache = GenerationCache(
+            settings.generation_cache_dir,
+            settings.generation_cache_max_mb * 1024 * 1024
+        )
+    return _shared_cache
+
+
+# Concurrent identical generations share one BFL task
+_single_flight = SingleFlight("bfl")
+
+
+async def close_shared_http_client():
+    """Stop the shared poller and close the BFL connection pool (called on app shutdown)."""
+    global _shared_http_client, _shared_poller
+    if _shared_poller is not None:
+        await _shared_poller.close()
+        _shared_poller = None
+    if _shared_http_client is not None:
+        await _shared_http_client.aclose()
+        _shared_http_client = None
+
+
+@dataclass(frozen=True)
+class PreparedImage:
+    """An upload compressed and base64-encoded once, reusable across many edits.
+    
+    Every request built from the same handle references the same `base64`
+    string instead of re-running compression and encoding.
+    """
+    data: bytes  # Image bytes as sent to BFL (compressed if needed)
+    base64: str  # Base64 of `data`, shared by every request payload
+    source_hash: str  # SHA-256 of the original upload
+    was_compressed: bool
 
 
 class BFLClient:
@@ -20,10 +116,22 @@ class BFLClient:
             "x-key": self.api_key,
             "Content-Type": "application/json"
         }
+        self.limiter = get_shared_limiter()
+        self.cache = get_shared_cache()
         # BFL API limits
         self.max_image_size_mb = 20
         self.max_megapixels = 20
     
+    @property
+    def http(self) -> httpx.AsyncClient:
+        # Submit, poll and download all reuse one keep-alive pool; looked up
+        # on each use because shutdown closes it and a later start makes a new one
+        return get_shared_http_client()
+    
+    @property
+    def poller(self) -> BFLPoller:
+        return get_shared_poller()
+    
     def _compress_image(self, image_data: bytes) -> Tuple[bytes, bool]:
         """Compress image to meet BFL API requirements.
         
@@ -110,41 +218,77 @@ class BFLClient:
         
         raise ValueError(f"Unable to compress image to under {self.max_image_size_mb}MB")
     
+    def _prepare(self, image_data: bytes) -> PreparedImage:
+        # Compress image if needed
+        compressed_data, was_compressed = self._compress_image(image_data)
+        if was_compressed:
+            print("[DEBUG] Image was compressed to meet BFL API limits")
+        
+        return PreparedImage(
+            data=compressed_data,
+            base64=base64.b64encode(compressed_data).decode('utf-8'),
+            source_hash=hashlib.sha256(image_data).hexdigest(),
+            was_compressed=was_compressed
+        )
+    
+    async def prepare_image(self, image: Union[bytes, PreparedImage]) -> PreparedImage:
+        """Compress and encode an upload once so several edits can share it.
+        
+        The decode/compress/encode work runs in a thread to keep the event loop free.
+        """
+        if isinstance(image, PreparedImage):
+            return image
+        return await asyncio.to_thread(self._prepare, image)
+    
     async def generate_image_edit(self, 
-                                 image_data: bytes, 
+                                 image: Union[bytes, PreparedImage], 
                                  prompt: str,
                                  aspect_ratio: str = "1:1",
                                  output_format: str = "png",
-                                 safety_tolerance: int = 2) -> bytes:
-        """Generate an edited image using FLUX.1 Kontext."""
+                                 safety_tolerance: int = 2,
+                                 use_cache: bool = True) -> bytes:
+        """Generate an edited image using FLUX.1 Kontext.
         
-        # Compress image if needed
-        compressed_data, was_compressed = self._compress_image(image_data)
-        if was_compressed:
-            print("[DEBUG] Image was compressed to meet BFL API limits")
+        Pass a PreparedImage when editing the same upload several times.
+        Identical requests (same source, prompt, aspect ratio, format and
+        model) are served from the generation cache, and concurrent ones
+        share a single generation. `use_cache=False` always generates anew.
+        """
+        prepared = await self.prepare_image(image)
         
-        # Convert image to base64
-        image_base64 = base64.b64encode(compressed_data).decode('utf-8')
+        cache_key = None
+        if self.cache and use_cache:
+            cache_key = GenerationCache.make_key(
+                prepared.source_hash, prompt, aspect_ratio, output_format, settings.bfl_model
+            )
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                print(f"[DEBUG] Generation cache hit: {cache_key[:12]}")
+                return cached
         
         # Prepare the request payload
         payload = {
             "prompt": prompt,
-            "input_image": image_base64,
+            "input_image": prepared.base64,
             "aspect_ratio": aspect_ratio,
             "output_format": output_format,
             "safety_tolerance": safety_tolerance
         }
         
-        async with httpx.AsyncClient(timeout=300.0) as client:
+        if not use_cache:
+            return await self._generate(payload, None)
+        
+        key = fingerprint(prepared.source_hash, prompt, aspect_ratio, output_format,
+                          safety_tolerance, settings.bfl_model)
+        return await _single_flight.do(key, lambda: self._generate(payload, cache_key))
+    
+    async def _generate(self, payload: Dict[str, Any], cache_key: Optional[str]) -> bytes:
+        """Submit, poll and download one generation, storing it under `cache_key`."""
+        # Hold a slot in the shared window while BFL counts this as an active task
+        await self.limiter.acquire()
+        try:
             # Submit the generation request
-            response = await client.post(
-                f"{self.base_url}/flux-kontext-pro",
-                headers=self.headers,
-                json=payload
-            )
-            response.raise_for_status()
-            
-            result = response.json()
+            result = await self._submit(payload)
             
             # Get the polling URL and request ID
             polling_url = result.get("polling_url")
@@ -158,79 +302,72 @@ class BFLClient:
             
             # Poll for completion
             generated_image_url = await self._poll_for_completion(polling_url, request_id)
-            
-            # Download the generated image
-            print(f"[DEBUG] Downloading image from: {generated_image_url}")
-            
-            # The signed URL should work without additional auth headers
-            # Create a new client without auth headers for the download
-            download_client = httpx.AsyncClient(timeout=30.0)
-            try:
-                # The URL might already be properly encoded, try using it directly
-                image_response = await download_client.get(
-                    generated_image_url,
-                    follow_redirects=True
-                )
-                image_response.raise_for_status()
-                
-                print(f"[DEBUG] Image downloaded successfully, size: {len(image_response.content)} bytes")
-                return image_response.content
-            except httpx.HTTPStatusError as e:
-                print(f"[DEBUG] Download failed with status {e.response.status_code}")
-                print(f"[DEBUG] Response headers: {e.response.headers}")
-                print(f"[DEBUG] Response body: {e.response.text}")
-                raise
-            finally:
-                await download_client.aclose()
-    
-    async def _poll_for_completion(self, polling_url: str, request_id: Optional[str] = None, max_attempts: int = 60) -> str:
-        """Poll the API until the image generation is complete."""
+        finally:
+            await self.limiter.release()
         
-        print(f"[DEBUG] Starting to poll: {polling_url}")
+        # Download the generated image
+        print(f"[DEBUG] Downloading image from: {generated_image_url}")
         
-        # Prepare params - only add id if not already in the URL
-        params = {}
-        if request_id and f"id={request_id}" not in polling_url:
-            params["id"] = request_id
-            print(f"[DEBUG] Adding request ID to params: {request_id}")
+        # The signed URL works without auth headers, so none are sent here
+        try:
+            # The URL might already be properly encoded, try using it directly
+            image_response = await self.http.get(
+                generated_image_url,
+                follow_redirects=True,
+                timeout=30.0
+            )
+            image_response.raise_for_status()
+            
+            print(f"[DEBUG] Image downloaded successfully, size: {len(image_response.content)} bytes")
+            if cache_key:
+                await self.cache.put(cache_key, image_response.content, payload["output_format"])
+            return image_response.content
+        except httpx.HTTPStatusError as e:
+            print(f"[DEBUG] Download failed with status {e.response.status_code}")
+            print(f"[DEBUG] Response headers: {e.response.headers}")
+            print(f"[DEBUG] Response body: {e.response.text}")
+            raise
+    
+    async def _submit(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Submit a generation request, feeding upstream signals to the limiter.
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            for attempt in range(max_attempts):
-                response = await client.get(
-                    polling_url,
-                    headers={"x-key": self.api_key},
-                    params=params if params else None
-                )
-                response.raise_for_status()
-                
-                result = response.json()
-                status = result.get("status")
-                
-                print(f"[DEBUG] Poll attempt {attempt + 1}: Status = {status}")
-                
-                if status == "Ready":
-                    # Get the generated image URL
-                    sample = result.get("result", {}).get("sample")
-                    if not sample:
-                        raise Exception("No sample URL in completed result")
-                    print(f"[DEBUG] Got image URL: {sample}")
-                    return sample
-                
-                elif status == "Failed":
-                    error_msg = result.get("error", "Unknown error")
-                    raise Exception(f"Image generation failed: {error_msg}")
-                
-                elif status == "Pending" or status == "Processing":
-                    # Wait before polling again
-                    await asyncio.sleep(2)
+        429 and 5xx responses shrink the shared window and are retried with
+        backoff (honouring Retry-After); fast successes grow the window.
+        """
+        for attempt in range(settings.bfl_submit_retries + 1):
+            started = time.monotonic()
+            response = await self.http.post(
+                f"{self.base_url}/{settings.bfl_model}",
+                headers=self.headers,
+                json=payload
+            )
+            
+            if response.status_code == 429 or response.status_code >= 500:
+                await self.limiter.record_congestion()
+                if attempt == settings.bfl_submit_retries:
+                    response.raise_for_status()
                 
-                else:
-                    raise Exception(f"Unknown status: {status}")
+                retry_after = response.headers.get("retry-after")
+                try:
+                    delay = float(retry_after)
+                except (TypeError, ValueError):
+                    delay = 2 ** attempt
+                print(f"[DEBUG] BFL returned {response.status_code}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay * random.uniform(1.0, 1.5))
+                continue
             
-            raise Exception("Polling timeout: Image generation took too long")
+            response.raise_for_status()
+            await self.limiter.record_success(time.monotonic() - started)
+            return response.json()
+    
+    async def _poll_for_completion(self, polling_url: str, request_id: Optional[str] = None) -> str:
+        """Wait for the image generation to complete via the shared poller."""
+        
+        print(f"[DEBUG] Waiting on poller for: {polling_url}")
+        return await self.poller.wait_for(polling_url, request_id, {"x-key": self.api_key})
     
     async def generate_multiple_variations(self,
-                                         image_data: bytes,
+                                         image_data: Union[bytes, PreparedImage],
                                          prompts: List[str],
                                          save_directory: str = "enhanced") -> List[Dict[str, Any]]:
         """Generate multiple image variations with different prompts."""
@@ -238,46 +375,38 @@ class BFLClient:
         os.makedirs(save_directory, exist_ok=True)
         results = []
         
-        # Process prompts in batches to avoid overwhelming the API
-        batch_size = 2
-        for i in range(0, len(prompts), batch_size):
-            batch = prompts[i:i + batch_size]
-            
-            # Create tasks for parallel processing
-            tasks = []
-            for j, prompt in enumerate(batch):
-                task = self._generate_single_variation(
-                    image_data, 
-                    prompt, 
-                    f"variation_{i+j+1}",
-                    save_directory
-                )
-                tasks.append(task)
-            
-            # Execute batch
-            batch_results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            # Process results
-            for idx, result in enumerate(batch_results):
-                if isinstance(result, Exception):
-                    results.append({
-                        "type": f"variation_{i+idx+1}",
-                        "prompt": batch[idx],
-                        "error": str(result),
-                        "path": None,
-                        "url": None
-                    })
-                else:
-                    results.append(result)
-            
-            # Small delay between batches
-            if i + batch_size < len(prompts):
-                await asyncio.sleep(2)
+        # Compress and encode the source once for every prompt
+        prepared = await self.prepare_image(image_data)
+        
+        # Submit everything at once; the shared limiter paces actual submissions
+        tasks = [
+            self._generate_single_variation(
+                prepared, 
+                prompt, 
+                f"variation_{i+1}",
+                save_directory
+            )
+            for i, prompt in enumerate(prompts)
+        ]
+        variation_results = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        # Process results
+        for i, result in enumerate(variation_results):
+            if isinstance(result, Exception):
+                results.append({
+                    "type": f"variation_{i+1}",
+                    "prompt": prompts[i],
+                    "error": str(result),
+                    "path": None,
+                    "url": None
+                })
+            else:
+                results.append(result)
         
         return results
     
     async def _generate_single_variation(self,
-                                       image_data: bytes,
+                                       image_data: Union[bytes, PreparedImage],
                                        prompt: str,
                                        variation_type: str,
                                        save_directory: str) -> Dict[str, Any]:
@@ -0,0 +1,185 @@
+import httpx
+import asyncio
+import random
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+from app.config import settings
+
+
+@dataclass
+class _PendingRequest:
+    polling_url: str
+    params: Optional[Dict[str, str]]
+    headers: Dict[str, str]
+    future: asyncio.Future
+    submitted_at: float
+    deadline: float
+    next_poll_at: float
+    interval: float
+    errors: int = 0
+    attempts: int = 0
+
+
+class BFLPoller:
+    """Polls every in-flight FLUX request from a single background loop.
+
+    The first poll for a request is scheduled close to the typical generation
+    time (an EWMA of observed completions); after that the interval grows
+    geometrically with jitter so concurrent requests don't poll in lockstep.
+    """
+
+    def __init__(self, get_http: Callable[[], httpx.AsyncClient]):
+        # Looked up per poll so a client recreated after shutdown is picked up
+        self._get_http = get_http
+        self.min_interval = settings.bfl_poll_min_interval
+        self.max_interval = settings.bfl_poll_max_interval
+        self.backoff = settings.bfl_poll_backoff
+        self.jitter = settings.bfl_poll_jitter
+        self.timeout = settings.bfl_poll_timeout
+        self.max_errors = 3
+
+        # Typical submit-to-ready time, learned from completed requests
+        self.expected_duration = settings.bfl_poll_initial_delay
+
+        self._pending: Dict[int, _PendingRequest] = {}
+        self._next_key = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._poll_slots: Optional[asyncio.Semaphore] = None
+        self._in_flight = set()
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        return self._get_http()
+
+    def _jittered(self, delay: float) -> float:
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def wait_for(self, polling_url: str, request_id: Optional[str], headers: Dict[str, str]) -> str:
+        """Wait until the request is Ready and return its sample URL."""
+        loop = asyncio.get_running_loop()
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+            self._poll_slots = asyncio.Semaphore(settings.bfl_poll_concurrency)
+
+        # Only add id if not already in the URL
+        params = None
+        if request_id and f"id={request_id}" not in polling_url:
+            params = {"id": request_id}
+
+        now = loop.time()
+        pending = _PendingRequest(
+            polling_url=polling_url,
+            params=params,
+            headers=headers,
+            future=loop.create_future(),
+            submitted_at=now,
+            deadline=now + self.timeout,
+            next_poll_at=now + self._jittered(max(self.min_interval, 0.8 * self.expected_duration)),
+            interval=self.min_interval
+        )
+        key = self._next_key
+        self._next_key += 1
+        self._pending[key] = pending
+
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+        try:
+            return await pending.future
+        finally:
+            self._pending.pop(key, None)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            self._wakeup.clear()
+            now = loop.time()
+
+            for pending in list(self._pending.values()):
+                if pending.next_poll_at <= now:
+                    # Parked until the poll finishes and reschedules it
+                    pending.next_poll_at = float("inf")
+                    task = asyncio.create_task(self._poll(pending))
+                    self._in_flight.add(task)
+                    task.add_done_callback(self._in_flight.discard)
+
+            next_poll_at = min((p.next_poll_at for p in self._pending.values()), default=now)
+            timeout = None if next_poll_at == float("inf") else max(0.0, next_poll_at - now)
+            try:
+                # Sleep until the next request is due, a poll finishes or a new one arrives
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, pending: _PendingRequest):
+        loop = asyncio.get_running_loop()
+        pending.attempts += 1
+
+        try:
+            async with self._poll_slots:
+                response = await self.http.get(
+                    pending.polling_url,
+                    headers=pending.headers,
+                    params=pending.params,
+                    timeout=30.0
+                )
+            response.raise_for_status()
+            result = response.json()
+        except Exception as e:
+            pending.errors += 1
+            if pending.errors >= self.max_errors:
+                self._fail(pending, e)
+            else:
+                self._reschedule(pending, loop.time())
+            return
+
+        pending.errors = 0
+        status = result.get("status")
+        now = loop.time()
+
+        if status == "Ready":
+            # Get the generated image URL
+            sample = result.get("result", {}).get("sample")
+            if not sample:
+                self._fail(pending, Exception("No sample URL in completed result"))
+                return
+            self.expected_duration = 0.8 * self.expected_duration + 0.2 * (now - pending.submitted_at)
+            print(f"[DEBUG] Request ready after {pending.attempts} polls: {sample}")
+            if not pending.future.done():
+                pending.future.set_result(sample)
+
+        elif status == "Failed":
+            error_msg = result.get("error", "Unknown error")
+            self._fail(pending, Exception(f"Image generation failed: {error_msg}"))
+
+        elif status == "Pending" or status == "Processing":
+            self._reschedule(pending, now)
+
+        else:
+            self._fail(pending, Exception(f"Unknown status: {status}"))
+
+    def _reschedule(self, pending: _PendingRequest, now: float):
+        if now >= pending.deadline:
+            self._fail(pending, Exception("Polling timeout: Image generation took too long"))
+            return
+        pending.next_poll_at = now + self._jittered(pending.interval)
+        pending.interval = min(pending.interval * self.backoff, self.max_interval)
+        self._wakeup.set()
+
+    def _fail(self, pending: _PendingRequest, error: Exception):
+        if not pending.future.done():
+            pending.future.set_exception(error)
+
+    async def close(self):
+        """Stop the polling loop and fail anything still waiting."""
+        for pending in list(self._pending.values()):
+            self._fail(pending, Exception("Poller closed"))
+        tasks = list(self._in_flight)
+        if self._loop_task is not None:
+            tasks.append(self._loop_task)
+            self._loop_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
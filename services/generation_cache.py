@@ -0,0 +1,93 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Any, Optional
+
+
+class GenerationCache:
+    """Content-addressed on-disk cache of generated images.
+
+    Entries are keyed by everything that determines the output (source image
+    hash, prompt, aspect ratio, output format, model). An `index.json` in the
+    cache directory tracks sizes and last use so the least recently used
+    entries are evicted once the total size exceeds `max_bytes`.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, "index.json")
+        self._lock = asyncio.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._index: Dict[str, Dict[str, Any]] = self._load_index()
+
+    @staticmethod
+    def make_key(source_hash: str, prompt: str, aspect_ratio: str, output_format: str, model: str) -> str:
+        fingerprint = json.dumps([source_hash, prompt, aspect_ratio, output_format, model])
+        return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        # Drop entries whose files went missing
+        return {
+            key: entry for key, entry in index.items()
+            if os.path.exists(os.path.join(self.directory, entry["file"]))
+        }
+
+    def _save_index(self):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _read(self, filename: str) -> bytes:
+        with open(os.path.join(self.directory, filename), "rb") as f:
+            return f.read()
+
+    def _write(self, filename: str, data: bytes):
+        with open(os.path.join(self.directory, filename), "wb") as f:
+            f.write(data)
+
+    def _evict(self):
+        total = sum(entry["size"] for entry in self._index.values())
+        for key, entry in sorted(self._index.items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, entry["file"]))
+            except FileNotFoundError:
+                pass
+            total -= entry["size"]
+            del self._index[key]
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Return the cached image for `key`, or None on a miss."""
+        async with self._lock:
+            entry = self._index.get(key)
+            if not entry:
+                return None
+            try:
+                data = await asyncio.to_thread(self._read, entry["file"])
+            except FileNotFoundError:
+                del self._index[key]
+                await asyncio.to_thread(self._save_index)
+                return None
+            entry["last_used"] = time.time()
+            await asyncio.to_thread(self._save_index)
+            return data
+
+    async def put(self, key: str, data: bytes, output_format: str):
+        """Store an image, evicting least recently used entries if over budget."""
+        filename = f"{key}.{output_format}"
+        async with self._lock:
+            await asyncio.to_thread(self._write, filename, data)
+            self._index[key] = {"file": filename, "size": len(data), "last_used": time.time()}
+            self._evict()
+            await asyncio.to_thread(self._save_index)
@@ -7,6 +7,10 @@ from app.config import settings
 import uuid
 
 
+# Shared with SmartImageGenerator so both hit the same generation cache entry
+BACKGROUND_REMOVAL_PROMPT = "Product on clean white background, professional lighting, centered composition"
+
+
 class ImageEnhancer:
     def __init__(self):
         self.client = BFLClient()
@@ -58,15 +62,12 @@ class ImageEnhancer:
         if not valid:
             raise ValueError(error)
         
-        # Save original image
-        original_path = self.save_image(image_data, self.upload_dir)
-        
         # Enhance image using BFL
-        prompt = "Product on clean white background, professional lighting" if enhancement_type == "background_removal" else "Enhanced product image with improved quality and lighting"
+        prompt = BACKGROUND_REMOVAL_PROMPT if enhancement_type == "background_removal" else "Enhanced product image with improved quality and lighting"
         enhanced_data = await self.client.generate_image_edit(image_data, prompt)
         
         # Save enhanced image
-        enhanced_filename = f"enhanced_{os.path.basename(original_path)}"
+        enhanced_filename = f"enhanced_{uuid.uuid4()}.png"
         enhanced_path = self.save_image(enhanced_data, self.enhanced_dir, enhanced_filename)
         
         return enhanced_data, enhanced_path
@@ -1,8 +1,8 @@
 from typing import Dict, List, Any, Optional
 from services.openai_client import OpenAIClient
 from services.price_researcher import PriceResearcher
-from app.config import settings
-import json
+from services.response_schemas import ImageRecommendationsReply
+from services.structured_output import create_structured, StructuredOutputError
 
 
 class ImageInsightsService:
@@ -35,57 +35,33 @@ Based on successful listings in this category, recommend specific product images
 4. What comparison or scale images help
 5. What staging or backgrounds work best
 
-Provide a detailed JSON response with this structure:
-{{
-    "recommended_shots": [
-        {{
-            "type": "angle/lifestyle/detail/comparison",
-            "description": "specific description of the shot",
-            "prompt_elements": ["key", "visual", "elements"],
-            "priority": "high/medium/low"
-        }}
-    ],
-    "styling_recommendations": {{
-        "backgrounds": ["white", "lifestyle setting", etc],
-        "lighting": "natural/studio/dramatic",
-        "props": ["items to include in shots"],
-        "mood": "professional/casual/luxury"
-    }},
-    "category_insights": "specific tips for this product category"
-}}
-
-Return ONLY the JSON object."""
-        
-        response = await self.openai_client.client.responses.create(
-            model=settings.openai_model,
-            input=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "input_text",
-                            "text": prompt
-                        }
-                    ]
-                }
-            ]
-        )
+Provide a detailed response with:
+- recommended_shots: each with a type (angle/lifestyle/detail/comparison), a specific
+  description of the shot, its key visual prompt_elements and a priority (high/medium/low)
+- styling_recommendations: backgrounds (e.g. white, lifestyle setting), lighting
+  (natural/studio/dramatic), props to include in shots and mood (professional/casual/luxury)
+- category_insights: specific tips for this product category"""
         
         try:
-            # Extract content from response
-            if hasattr(response, 'content'):
-                result_text = response.content
-            elif hasattr(response, 'choices') and response.choices:
-                result_text = response.choices[0].message.content
-            else:
-                result_text = str(response)
-            start_idx = result_text.find("{")
-            end_idx = result_text.rfind("}") + 1
-            if start_idx != -1 and end_idx > start_idx:
-                json_str = result_text[start_idx:end_idx]
-                return json.loads(json_str)
-        except:
-            pass
+            reply = await create_structured(
+                self.openai_client.client,
+                "image_recommendations",
+                ImageRecommendationsReply,
+                input=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "input_text",
+                                "text": prompt
+                            }
+                        ]
+                    }
+                ]
+            )
+            return reply.model_dump()
+        except StructuredOutputError as e:
+            print(f"[DEBUG] Error parsing image recommendations: {str(e)}")
         
         # Fallback recommendations
         return self._get_default_recommendations(category)
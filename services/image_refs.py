@@ -0,0 +1,168 @@
+import asyncio
+import contextvars
+import hashlib
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Set, Union
+from app.config import settings
+from services.openai_scheduler import scheduled, PRIORITY_STANDARD, PRIORITY_BACKGROUND
+from services.vision_preprocessor import ImageInput, VisionImage, read_image_bytes, preprocess_for_vision
+
+
+@dataclass(frozen=True)
+class ImageRef:
+    """A vision image registered once and referenced by ID in later prompts."""
+    ref_id: str
+    detail: str
+
+
+class OpenAIFileImageStore:
+    """Uploads images to OpenAI Files (purpose "vision") and references them by file_id."""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def register(self, image: VisionImage) -> ImageRef:
+        extension = image.mime_type.split("/")[-1]
+        uploaded = await scheduled(
+            self.client.files.create,
+            PRIORITY_STANDARD,
+            file=(f"vision.{extension}", image.data, image.mime_type),
+            purpose="vision"
+        )
+        print(f"[DEBUG] Uploaded vision image as {uploaded.id}")
+        return ImageRef(ref_id=uploaded.id, detail=image.detail)
+
+    def input_part(self, ref: ImageRef) -> Dict[str, Any]:
+        return {"type": "input_image", "file_id": ref.ref_id, "detail": ref.detail}
+
+    async def release(self, ref: ImageRef):
+        await scheduled(self.client.files.delete, PRIORITY_BACKGROUND, file_id=ref.ref_id)
+
+
+class LocalImageStore:
+    """In-memory stand-in for tests and offline runs; refs resolve to inline data URLs."""
+
+    def __init__(self):
+        self._images: Dict[str, VisionImage] = {}
+
+    async def register(self, image: VisionImage) -> ImageRef:
+        ref_id = f"local-{uuid.uuid4().hex}"
+        self._images[ref_id] = image
+        return ImageRef(ref_id=ref_id, detail=image.detail)
+
+    def input_part(self, ref: ImageRef) -> Dict[str, Any]:
+        return self._images[ref.ref_id].input_part()
+
+    async def release(self, ref: ImageRef):
+        self._images.pop(ref.ref_id, None)
+
+
+class ImageRefScope:
+    """Per-request memo of preprocessed images and their registered refs.
+
+    Every LLM call in the request that sends the same image gets the same
+    derivative, even when the calls run concurrently. An image is registered
+    with the store only on its second use; the first call sends it inline,
+    so images used once cost no extra round trips. Without a store
+    (IMAGE_REF_STORE=inline) only preprocessing is shared.
+    """
+
+    def __init__(self, store=None):
+        self.store = store
+        self._prepared: Dict[str, asyncio.Future] = {}
+        self._refs: Dict[str, asyncio.Future] = {}
+        self._uses: Dict[str, int] = {}
+
+    @staticmethod
+    async def _once(futures: Dict[str, asyncio.Future], key: str, factory):
+        future = futures.get(key)
+        if future is None:
+            future = asyncio.ensure_future(factory())
+            futures[key] = future
+        # Shielded so one cancelled caller doesn't cancel the shared work
+        return await asyncio.shield(future)
+
+    async def vision_image(self, image: Union[ImageInput, VisionImage]) -> VisionImage:
+        if isinstance(image, VisionImage):
+            return image
+        data = read_image_bytes(image)
+        key = hashlib.sha256(data).hexdigest()
+        return await self._once(
+            self._prepared, key, lambda: asyncio.to_thread(preprocess_for_vision, data)
+        )
+
+    async def ref(self, image: Union[ImageInput, VisionImage]) -> Optional[ImageRef]:
+        """The image's ref, or None when it should be sent inline (no store, or first use)."""
+        if self.store is None:
+            return None
+        vision_image = await self.vision_image(image)
+        key = hashlib.sha256(vision_image.data).hexdigest()
+        self._uses[key] = self._uses.get(key, 0) + 1
+        if self._uses[key] < 2 and key not in self._refs:
+            return None
+        return await self._once(self._refs, key, lambda: self.store.register(vision_image))
+
+    async def close(self):
+        """Release every ref registered in this scope, off the caller's response path."""
+        if self._refs:
+            task = asyncio.create_task(self._release(list(self._refs.values())))
+            _pending_releases.add(task)
+            task.add_done_callback(_pending_releases.discard)
+        self._refs.clear()
+        self._uses.clear()
+        self._prepared.clear()
+
+    async def _release(self, futures):
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        refs = [ref for ref in results if isinstance(ref, ImageRef)]
+        released = await asyncio.gather(*(self.store.release(ref) for ref in refs), return_exceptions=True)
+        for error in released:
+            if isinstance(error, Exception):
+                print(f"[DEBUG] Failed to release image ref: {str(error)}")
+
+
+# Background release tasks, kept referenced until they finish
+_pending_releases: Set[asyncio.Task] = set()
+
+
+async def wait_for_image_releases():
+    """Let outstanding ref releases finish (called on app shutdown)."""
+    if _pending_releases:
+        await asyncio.gather(*_pending_releases, return_exceptions=True)
+
+
+_current_scope: contextvars.ContextVar[Optional[ImageRefScope]] = contextvars.ContextVar(
+    "image_ref_scope", default=None
+)
+
+
+def current_image_scope() -> Optional[ImageRefScope]:
+    """Return the scope opened by the enclosing request, if any."""
+    return _current_scope.get()
+
+
+def _build_store():
+    if settings.image_ref_store == "openai":
+        from services.openai_client import get_shared_openai_client
+        return OpenAIFileImageStore(get_shared_openai_client())
+    if settings.image_ref_store == "local":
+        return LocalImageStore()
+    return None
+
+
+@asynccontextmanager
+async def image_ref_scope():
+    """Share one upload per image across all LLM calls made inside the block.
+
+    The scope is carried in a context variable, so tasks started inside the
+    block (pipeline stages, gathered prompt calls) see it too.
+    """
+    scope = ImageRefScope(_build_store())
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+        await scope.close()
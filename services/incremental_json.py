@@ -0,0 +1,113 @@
+import json
+from typing import Any, List, Optional, Tuple
+
+
+class IncrementalJSONParser:
+    """Parses a streamed JSON object, reporting each top-level field once complete.
+
+    Feed it text chunks as they arrive; `feed` returns the (key, value) pairs
+    whose values were closed off by that chunk. A field counts as complete
+    when the delimiter after its value (`,` or the closing `}`) arrives.
+    Values that don't decode are skipped; validating the whole reply is
+    still the caller's job. `partial_value` exposes a string value that is
+    still being streamed, for forwarding text as it is generated.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._state = "start"
+        self._key = None
+        self._token_start = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        self._buffer += chunk
+        completed = []
+
+        while self._pos < len(self._buffer) and self._state != "done":
+            ch = self._buffer[self._pos]
+            state = self._state
+
+            if state == "start":
+                if ch == "{":
+                    self._state = "before_key"
+
+            elif state == "before_key":
+                if ch == '"':
+                    self._token_start = self._pos
+                    self._state = "key"
+                elif ch == "}":
+                    self._state = "done"
+
+            elif state == "key":
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._key = json.loads(self._buffer[self._token_start:self._pos + 1])
+                    self._state = "before_colon"
+
+            elif state == "before_colon":
+                if ch == ":":
+                    self._state = "before_value"
+
+            elif state == "before_value":
+                if not ch.isspace():
+                    self._token_start = self._pos
+                    self._depth = 0
+                    self._in_string = False
+                    self._state = "value"
+                    continue  # Re-read this character as part of the value
+
+            elif state == "value":
+                if self._in_string:
+                    if self._escape:
+                        self._escape = False
+                    elif ch == "\\":
+                        self._escape = True
+                    elif ch == '"':
+                        self._in_string = False
+                elif ch == '"':
+                    self._in_string = True
+                elif ch in "{[":
+                    self._depth += 1
+                elif ch in "}]" and self._depth > 0:
+                    self._depth -= 1
+                elif ch in ",}" and self._depth == 0:
+                    self._emit(completed)
+                    self._state = "before_key" if ch == "," else "done"
+
+            self._pos += 1
+
+        return completed
+
+    def partial_value(self) -> Optional[Tuple[str, str]]:
+        """(key, text so far) while a top-level string value is still streaming."""
+        if self._state != "value" or not self._in_string or self._depth != 0:
+            return None
+        if self._buffer[self._token_start] != '"':
+            return None
+
+        raw = self._buffer[self._token_start + 1:self._pos]
+        # Drop a trailing escape sequence that hasn't fully arrived yet
+        for cut in range(min(len(raw), 6) + 1):
+            try:
+                return self._key, json.loads('"' + raw[:len(raw) - cut] + '"')
+            except ValueError:
+                continue
+        return None
+
+    def _emit(self, completed: List[Tuple[str, Any]]):
+        raw = self._buffer[self._token_start:self._pos].strip()
+        try:
+            completed.append((self._key, json.loads(raw)))
+        except ValueError:
+            pass
@@ -1,17 +1,86 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 from services.openai_client import OpenAIClient
+from services.structured_output import FieldCallback
+from services.vision_preprocessor import ImageInput
+from services.analysis_cache import get_shared_analysis_cache
 import json
 
 
 class ItemAnalyzer:
     def __init__(self):
         self.client = OpenAIClient()
+        self.cache = get_shared_analysis_cache()
     
-    async def analyze_item(self, image_path: str) -> Dict[str, Any]:
-        """Analyze item from image and extract detailed information."""
+    async def analyze_item(self, image: ImageInput,
+                           on_field: Optional[FieldCallback] = None) -> Dict[str, Any]:
+        """Analyze item from image bytes (or a path/buffer) and extract detailed information.
+        
+        Near-identical images (by perceptual hash) reuse a cached analysis.
+        `on_field(key, value)` is called for each field as soon as it is known
+        (streamed from the model, or all at once on a cache hit).
+        """
+        # Decode the upload once; the cache hashes the small derivative too
+        vision_image = await self.client.prepare_vision_image(image)
+        
+        phash = None
+        if self.cache:
+            phash, cached = await self.cache.get(vision_image.data)
+            if cached is not None:
+                print(f"[DEBUG] Analysis cache hit for phash {phash:016x}")
+                self._publish(cached, on_field)
+                return cached
+        
         # Use OpenAI client to analyze the image
-        analysis = await self.client.analyze_image(image_path)
+        analysis = self._complete_analysis(await self.client.analyze_image(vision_image, on_field))
+        
+        # Don't cache the fallback returned when the model reply was unusable
+        if phash is not None and analysis["item_name"] != "Unknown Item":
+            await self.cache.put(phash, analysis)
+        
+        return analysis
+    
+    async def analyze_item_with_listing(self, image: ImageInput,
+                                        on_field: Optional[FieldCallback] = None) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """One-shot mode: analysis and a listing draft from a single model call.
+        
+        Returns (analysis, listing_draft), where the draft holds the title,
+        description and keywords for ListingGenerator.build_listing. The draft
+        is None on a cache hit or when the combined reply was unusable; the
+        caller then generates the listing separately.
+        """
+        vision_image = await self.client.prepare_vision_image(image)
+        
+        phash = None
+        if self.cache:
+            phash, cached = await self.cache.get(vision_image.data)
+            if cached is not None:
+                print(f"[DEBUG] Analysis cache hit for phash {phash:016x}")
+                self._publish(cached, on_field)
+                return cached, None
         
+        result = await self.client.analyze_and_write_listing(vision_image, on_field)
+        if result is None:
+            return await self.analyze_item(vision_image, on_field), None
+        
+        listing_draft = {
+            "title": result.pop("title", ""),
+            "description": result.pop("description", ""),
+            "keywords": result.pop("keywords", [])
+        }
+        analysis = self._complete_analysis(result)
+        
+        if phash is not None and analysis["item_name"] != "Unknown Item":
+            await self.cache.put(phash, analysis)
+        
+        return analysis, listing_draft
+    
+    def _publish(self, analysis: Dict[str, Any], on_field: Optional[FieldCallback]):
+        if on_field:
+            for key, value in analysis.items():
+                on_field(key, value)
+    
+    def _complete_analysis(self, analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """Fill in missing fields with defaults, then clean the result."""
         # Ensure we have all required fields with defaults
         default_analysis = {
             "item_name": "Unknown Item",
@@ -33,9 +102,7 @@ class ItemAnalyzer:
                 analysis[key] = default_analysis[key]
         
         # Clean up the analysis
-        analysis = self._clean_analysis(analysis)
-        
-        return analysis
+        return self._clean_analysis(analysis)
     
     def _clean_analysis(self, analysis: Dict[str, Any]) -> Dict[str, Any]:
         """Clean and validate the analysis results."""
@@ -0,0 +1,114 @@
+from typing import Dict, Any, Optional, List, Callable, Awaitable
+from datetime import datetime
+import asyncio
+import traceback
+import uuid
+from sqlalchemy import update
+from app.models import Job
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while every pending slot is taken."""
+
+
+class JobQueue:
+    """Runs long pipeline jobs on a bounded pool of in-process workers.
+
+    Job state lives in the `jobs` table so any request can look it up by ID.
+    Payloads (e.g. raw upload bytes) stay in memory and are never persisted.
+    """
+
+    def __init__(self,
+                 handler: Callable[..., Awaitable[Dict[str, Any]]],
+                 session_factory: Callable,
+                 workers: int = 2,
+                 max_pending: int = 100):
+        self.handler = handler
+        self.session_factory = session_factory
+        self.workers = workers
+        self.max_pending = max_pending
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        """Fail jobs orphaned by a previous process and start the workers."""
+        async with self.session_factory() as db:
+            await db.execute(
+                update(Job)
+                .where(Job.status.in_(["queued", "running"]))
+                .values(status="failed", error="Interrupted by server restart", finished_at=datetime.utcnow())
+            )
+            await db.commit()
+
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Cancel the workers; unfinished jobs are failed on the next start."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, kind: str, params: Dict[str, Any], payload: Dict[str, Any]) -> str:
+        """Record a queued job and hand it to the workers.
+
+        `params` is stored with the job for reference; `payload` is passed to
+        the handler as keyword arguments.
+        """
+        if self._queue is None:
+            raise RuntimeError("Job queue has not been started")
+        if self._queue.full():
+            raise QueueFullError(f"Job queue is full ({self.max_pending} pending jobs)")
+
+        job_id = str(uuid.uuid4())
+        async with self.session_factory() as db:
+            db.add(Job(id=job_id, kind=kind, status="queued", params=params))
+            await db.commit()
+
+        try:
+            self._queue.put_nowait((job_id, payload))
+        except asyncio.QueueFull:
+            # Other submissions took the last slots while the row was written
+            await self._update(job_id, status="failed", error="Job queue is full", finished_at=datetime.utcnow())
+            raise QueueFullError(f"Job queue is full ({self.max_pending} pending jobs)")
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the current state of a job, or None if it does not exist."""
+        async with self.session_factory() as db:
+            job = await db.get(Job, job_id)
+            if not job:
+                return None
+            return {
+                "job_id": job.id,
+                "kind": job.kind,
+                "status": job.status,
+                "params": job.params,
+                "result": job.result,
+                "error": job.error,
+                "created_at": job.created_at,
+                "started_at": job.started_at,
+                "finished_at": job.finished_at
+            }
+
+    async def _update(self, job_id: str, **fields):
+        async with self.session_factory() as db:
+            await db.execute(update(Job).where(Job.id == job_id).values(**fields))
+            await db.commit()
+
+    async def _worker(self):
+        while True:
+            job_id, payload = await self._queue.get()
+            try:
+                await self._update(job_id, status="running", started_at=datetime.utcnow())
+                async with self.session_factory() as db:
+                    result = await self.handler(db=db, **payload)
+                await self._update(job_id, status="succeeded", result=result, finished_at=datetime.utcnow())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[ERROR] job {job_id} failed: {traceback.format_exc()}")
+                await self._update(job_id, status="failed", error=str(e), finished_at=datetime.utcnow())
+            finally:
+                self._queue.task_done()
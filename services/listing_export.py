@@ -0,0 +1,112 @@
+import json
+from datetime import datetime
+from io import StringIO
+from typing import Dict, Any, List, AsyncIterator
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import Integer, Float, DateTime
+
+# format -> (media type, file extension)
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet")
+}
+
+Chunks = AsyncIterator[List[Dict[str, Any]]]
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _flatten(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Tabular form of a row: lists and dicts become JSON strings."""
+    return {
+        key: json.dumps(value, default=_json_default) if isinstance(value, (list, dict)) else value
+        for key, value in row.items()
+    }
+
+
+class _ChunkSink:
+    """Write-only file object that hands back whatever was written since the last drain.
+
+    Tracks the absolute position itself, so the Parquet footer offsets stay
+    right even though earlier bytes have already been sent.
+    """
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def arrow_schema(column_types: Dict[str, Any]) -> pa.Schema:
+    """Parquet schema for SQLAlchemy column types; anything not numeric or a timestamp is a string."""
+    fields = []
+    for name, column_type in column_types.items():
+        if isinstance(column_type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(column_type, Float):
+            arrow_type = pa.float64()
+        elif isinstance(column_type, DateTime):
+            arrow_type = pa.timestamp("us")
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+async def ndjson_stream(chunks: Chunks) -> AsyncIterator[bytes]:
+    async for rows in chunks:
+        yield "".join(json.dumps(row, default=_json_default) + "\n" for row in rows).encode("utf-8")
+
+
+async def csv_stream(chunks: Chunks, columns: List[str]) -> AsyncIterator[bytes]:
+    header = True
+    async for rows in chunks:
+        buffer = StringIO()
+        frame = pd.DataFrame([_flatten(row) for row in rows], columns=columns)
+        frame.to_csv(buffer, index=False, header=header)
+        header = False
+        yield buffer.getvalue().encode("utf-8")
+    if header:
+        # No rows at all: still send the header line
+        yield (",".join(columns) + "\n").encode("utf-8")
+
+
+async def parquet_stream(chunks: Chunks, schema: pa.Schema) -> AsyncIterator[bytes]:
+    """One row group per chunk, sent as soon as it is encoded."""
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    try:
+        async for rows in chunks:
+            frame = pd.DataFrame([_flatten(row) for row in rows], columns=schema.names)
+            writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
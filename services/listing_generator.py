@@ -1,67 +1,115 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Callable
 from services.openai_client import OpenAIClient
-import re
+from services.structured_output import StructuredOutputError, FieldCallback
+
+
+PlatformFormatter = Callable[[Dict[str, Any]], Dict[str, Any]]
 
 
 class ListingGenerator:
     def __init__(self):
         self.client = OpenAIClient()
+        self.platform_formatters: Dict[str, PlatformFormatter] = {
+            "ebay": self._format_for_ebay,
+            "craigslist": self._format_for_craigslist,
+            "facebook": self._format_for_facebook
+        }
+    
+    def register_platform_formatter(self, platform: str, formatter: PlatformFormatter):
+        """Register (or replace) the formatter that renders a base listing for a platform."""
+        self.platform_formatters[platform] = formatter
     
     async def generate_listing(self, 
                              item_data: Dict[str, Any], 
                              price_data: Dict[str, Any],
-                             market_insights: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        """Generate complete listing with title, description, and keywords."""
+                             market_insights: Optional[Dict[str, Any]] = None,
+                             platforms: Optional[List[str]] = None,
+                             on_field: Optional[FieldCallback] = None,
+                             on_partial: Optional[FieldCallback] = None) -> Dict[str, Any]:
+        """Generate complete listing with title, description, and keywords.
+        
+        The listing text is generated once; `platform_versions` holds a local
+        rendering for each of `platforms` (all registered platforms by default).
+        `on_field`/`on_partial` stream the title, description and keywords as
+        they are generated.
+        """
         
         # Generate the listing content
-        listing_text = await self.client.generate_listing(item_data, price_data)
-        
-        # Parse the generated text
-        parsed = self._parse_listing_text(listing_text)
+        try:
+            listing_draft = await self.client.generate_listing(
+                item_data, price_data, on_field=on_field, on_partial=on_partial
+            )
+        except StructuredOutputError as e:
+            print(f"[DEBUG] Listing generation failed, using fallback: {str(e)}")
+            listing_draft = self._fallback_listing(item_data)
+        
+        return self.build_listing(listing_draft, price_data, market_insights, platforms)
+    
+    def build_listing(self, 
+                      listing_draft: Dict[str, Any], 
+                      price_data: Dict[str, Any],
+                      market_insights: Optional[Dict[str, Any]] = None,
+                      platforms: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Complete a drafted title/description/keywords without another LLM call.
+        
+        Used for both generate_listing and the one-shot analysis draft, so
+        both produce the same shape.
+        """
+        keywords = listing_draft.get("keywords") or []
+        if isinstance(keywords, str):
+            keywords = keywords.split(',')
+        
+        parsed = {
+            "title": (listing_draft.get("title") or "").strip(),
+            "description": (listing_draft.get("description") or "").strip(),
+            "keywords": [k.strip() for k in keywords if k and k.strip()]
+        }
+        if not parsed["title"]:
+            parsed["title"] = parsed["description"].split('\n')[0][:80] or "Item for Sale"
         
+        return self._finish_listing(parsed, price_data, market_insights, platforms)
+    
+    def _finish_listing(self, 
+                        parsed: Dict[str, Any], 
+                        price_data: Dict[str, Any],
+                        market_insights: Optional[Dict[str, Any]],
+                        platforms: Optional[List[str]]) -> Dict[str, Any]:
         # Add pricing recommendation
         parsed["suggested_price"] = self._calculate_suggested_price(price_data, market_insights)
         
         # Generate platform-specific versions
-        parsed["platform_versions"] = {
-            "ebay": self._format_for_ebay(parsed),
-            "craigslist": self._format_for_craigslist(parsed),
-            "facebook": self._format_for_facebook(parsed)
-        }
+        parsed["platform_versions"] = self.render_platform_listings(parsed, platforms)
         
         return parsed
     
-    def _parse_listing_text(self, text: str) -> Dict[str, Any]:
-        """Parse the generated listing text into components."""
-        result = {
-            "title": "",
-            "description": "",
-            "keywords": []
-        }
-        
-        # Extract title
-        title_match = re.search(r'TITLE:\s*(.+?)(?:\n|$)', text, re.IGNORECASE)
-        if title_match:
-            result["title"] = title_match.group(1).strip()
-        
-        # Extract description
-        desc_match = re.search(r'DESCRIPTION:\s*(.+?)(?:KEYWORDS:|$)', text, re.IGNORECASE | re.DOTALL)
-        if desc_match:
-            result["description"] = desc_match.group(1).strip()
-        
-        # Extract keywords
-        keywords_match = re.search(r'KEYWORDS:\s*(.+?)$', text, re.IGNORECASE)
-        if keywords_match:
-            keywords_text = keywords_match.group(1).strip()
-            result["keywords"] = [k.strip() for k in keywords_text.split(',')]
-        
-        # Fallback if parsing fails
-        if not result["title"] and not result["description"]:
-            # Use the entire text as description
-            result["description"] = text.strip()
-            result["title"] = text.split('\n')[0][:80] if text else "Item for Sale"
-        
-        return result
+    def render_platform_listing(self, listing: Dict[str, Any], platform: str) -> Dict[str, Any]:
+        """Render a base listing for one platform without another LLM call."""
+        formatter = self.platform_formatters.get(platform)
+        if not formatter:
+            return listing
+        return formatter(listing)
+    
+    def render_platform_listings(self, 
+                               listing: Dict[str, Any], 
+                               platforms: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Render a base listing for several platforms (all registered by default)."""
+        if platforms is None:
+            platforms = list(self.platform_formatters)
+        return {platform: self.render_platform_listing(listing, platform) for platform in platforms}
+    
+    def _fallback_listing(self, item_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Plain listing built from the analysis when the model reply is unusable."""
+        item_name = item_data.get("item_name", "Item")
+        brand = item_data.get("brand")
+        title = f"{brand} {item_name}" if brand and brand.lower() not in item_name.lower() else item_name
+        
+        description = f"{title} for sale. Condition: {item_data.get('condition', 'Unknown')}."
+        features = item_data.get("key_features") or []
+        if features:
+            description += "\n\n" + "\n".join(f"- {feature}" for feature in features)
+        
+        keywords = [k for k in [item_name, brand, item_data.get("category")] if k]
+        return {"title": title[:80], "description": description, "keywords": keywords}
     
     def _calculate_suggested_price(self, price_data: Dict[str, Any], 
                                  market_insights: Optional[Dict[str, Any]] = None) -> float:
@@ -157,21 +205,29 @@ Keywords: {', '.join(listing['keywords'][:5])}
             "category": "General"
         }
     
+    async def generate_platform_listings(self, 
+                                       item_data: Dict[str, Any], 
+                                       price_data: Dict[str, Any],
+                                       market_insights: Optional[Dict[str, Any]] = None,
+                                       platforms: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Generate the base listing once and fan it out to every requested platform."""
+        base_listing = await self.generate_listing(item_data, price_data, market_insights, platforms)
+        return base_listing["platform_versions"]
+    
     async def generate_platform_listing(self, 
                                       item_data: Dict[str, Any], 
                                       price_data: Dict[str, Any],
                                       market_insights: Optional[Dict[str, Any]],
-                                      platform: str) -> Dict[str, Any]:
-        """Generate a platform-specific listing."""
+                                      platform: str,
+                                      base_listing: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Generate a platform-specific listing.
+        
+        Pass `base_listing` from an earlier `generate_listing` call to skip the
+        LLM round trip and only render it for `platform`.
+        """
         # First generate the base listing
-        base_listing = await self.generate_listing(item_data, price_data, market_insights)
+        if base_listing is None:
+            base_listing = await self.generate_listing(item_data, price_data, market_insights, [])
         
         # Return the platform-specific version
-        if platform == "ebay":
-            return self._format_for_ebay(base_listing)
-        elif platform == "craigslist":
-            return self._format_for_craigslist(base_listing)
-        elif platform == "facebook":
-            return self._format_for_facebook(base_listing)
-        else:
-            return base_listing
\ No newline at end of file
+        return self.render_platform_listing(base_listing, platform)
@@ -1,30 +1,148 @@
 import openai
-from openai import OpenAI
+from openai import AsyncOpenAI
+import httpx
+import asyncio
 import base64
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Union, Callable, Awaitable
 import json
 from app.config import settings
+from services.vision_preprocessor import ImageInput, VisionImage, read_image_bytes, preprocess_for_vision
+from services.image_refs import current_image_scope
+from services.response_schemas import (
+    ItemAnalysisReply, ItemListingReply, ListingTextReply, MarketingPromptsReply
+)
+from services.structured_output import create_structured, StructuredOutputError, FieldCallback
+from services.openai_scheduler import (
+    scheduled, PRIORITY_INTERACTIVE, PRIORITY_STANDARD, PRIORITY_BACKGROUND
+)
+from services.single_flight import SingleFlight, fingerprint
+
+
+_shared_client: Optional[AsyncOpenAI] = None
+
+
+def _build_async_client(api_key: str) -> AsyncOpenAI:
+    """Build an AsyncOpenAI client on a pooled httpx transport."""
+    timeout = httpx.Timeout(settings.openai_timeout, connect=settings.openai_connect_timeout)
+    return AsyncOpenAI(
+        api_key=api_key,
+        timeout=timeout,
+        max_retries=0,  # Retries are handled by the shared OpenAI scheduler
+        http_client=httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=settings.openai_max_connections,
+                max_keepalive_connections=settings.openai_max_keepalive_connections
+            )
+        )
+    )
+
+
+def get_shared_openai_client() -> AsyncOpenAI:
+    """Return the process-wide AsyncOpenAI client and its connection pool."""
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = _build_async_client(settings.openai_api_key)
+    return _shared_client
+
+
+# Concurrent identical analysis/listing calls share one upstream request
+_single_flight = SingleFlight("openai")
+
+
+async def close_shared_openai_client():
+    """Close the shared client's connection pool (called on app shutdown)."""
+    global _shared_client
+    if _shared_client is not None:
+        await _shared_client.close()
+        _shared_client = None
 
 
 class OpenAIClient:
     def __init__(self, api_key: Optional[str] = None):
         self.api_key = api_key or settings.openai_api_key
-        self.client = OpenAI(api_key=self.api_key)
+        # Every instance shares one pool unless it needs a different key
+        self._own_client = None
+        if self.api_key != settings.openai_api_key:
+            self._own_client = _build_async_client(self.api_key)
+    
+    @property
+    def client(self) -> AsyncOpenAI:
+        # The shared client is looked up on each use: shutdown closes it and
+        # a later start builds a new one
+        return self._own_client or get_shared_openai_client()
+    
+    def encode_image_to_base64(self, image: ImageInput) -> str:
+        """Encode an image (path, bytes or buffer) to base64 string."""
+        return base64.b64encode(read_image_bytes(image)).decode('utf-8')
+    
+    async def prepare_vision_image(self, image: Union[ImageInput, VisionImage]) -> VisionImage:
+        """Downsize an image for vision prompts; already prepared images pass through."""
+        if isinstance(image, VisionImage):
+            return image
+        scope = current_image_scope()
+        if scope is not None:
+            return await scope.vision_image(image)
+        return await asyncio.to_thread(preprocess_for_vision, image)
     
-    def encode_image_to_base64(self, image_path: str) -> str:
-        """Encode a local image to base64 string."""
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+    async def image_input_part(self, image: Union[ImageInput, VisionImage]) -> Dict[str, Any]:
+        """Responses-API input part for an image.
+        
+        Inside an image_ref_scope the image is uploaded once and referenced by
+        ID; otherwise (or if the upload fails) it is sent inline.
+        """
+        vision_image = await self.prepare_vision_image(image)
+        scope = current_image_scope()
+        if scope is not None:
+            try:
+                ref = await scope.ref(vision_image)
+                if ref is not None:
+                    return scope.store.input_part(ref)
+            except Exception as e:
+                print(f"[DEBUG] Image upload failed, sending inline: {str(e)}")
+        return vision_image.input_part()
+    
+    async def _coalesced(self, key: str, call: Callable[[], Awaitable[Any]],
+                         on_field: Optional[FieldCallback] = None,
+                         on_partial: Optional[FieldCallback] = None) -> Any:
+        """Run `call()` once for concurrent identical requests.
+        
+        Only the caller that starts the shared request sees its reply stream;
+        callers joining it get the finished fields replayed through
+        `on_partial` (string fields, as one chunk) and `on_field`.
+        """
+        joined = _single_flight.in_flight(key)
+        result = await _single_flight.do(key, call)
+        if joined and isinstance(result, dict):
+            for field, value in result.items():
+                if on_partial and isinstance(value, str):
+                    on_partial(field, value)
+                if on_field:
+                    on_field(field, value)
+        return result
     
-    async def analyze_image(self, image_path: str) -> Dict[str, Any]:
-        """Analyze image using o1 model to identify item and extract features."""
+    async def analyze_image(self, image: Union[ImageInput, VisionImage],
+                            on_field: Optional[FieldCallback] = None) -> Dict[str, Any]:
+        """Analyze image using o1 model to identify item and extract features.
+        
+        Accepts raw upload bytes or a buffer, so callers never need a temp file.
+        With `on_field` the reply is streamed and `on_field(key, value)` is
+        called as soon as each field (item_name and category come first) is
+        complete, so dependent work can start before the reply finishes.
+        
+        Concurrent calls for the same image share one request.
+        """
         
-        print(f"[DEBUG] Starting image analysis for: {image_path}")
+        print("[DEBUG] Starting image analysis")
         
-        # Encode image to base64
-        base64_image = self.encode_image_to_base64(image_path)
-        print(f"[DEBUG] Image encoded to base64, length: {len(base64_image)}")
+        vision_image = await self.prepare_vision_image(image)
+        print(f"[DEBUG] Vision image {vision_image.width}x{vision_image.height} {vision_image.mime_type}, {len(vision_image.data)} bytes")
         
+        key = fingerprint("analyze_image", settings.openai_model, vision_image.data)
+        return await self._coalesced(key, lambda: self._analyze_image(vision_image, on_field), on_field)
+    
+    async def _analyze_image(self, vision_image: VisionImage,
+                             on_field: Optional[FieldCallback]) -> Dict[str, Any]:
         print(f"[DEBUG] Using model: {settings.openai_model}")
         
         prompt = """Analyze this image and provide a JSON response with the following structure:
@@ -44,54 +162,42 @@ class OpenAIClient:
         - Consider this is for resale marketplaces like eBay, Facebook Marketplace, etc.
         
         Return a realistic price as a whole number (no decimals, no dollar sign).
-        Be concise and accurate. Return ONLY the JSON object, no additional text."""
+        Be concise and accurate."""
         
         try:
-            response = self.client.chat.completions.create(
-                model=settings.openai_model,
-                messages=[
+            # Inline, not a scoped ref: joiners share this call, and the
+            # leader's ref is deleted when its request scope closes
+            image_part = vision_image.input_part()
+            reply = await create_structured(
+                self.client,
+                "analyze_image",
+                ItemAnalysisReply,
+                priority=PRIORITY_INTERACTIVE,
+                on_field=on_field,
+                input=[
                     {
                         "role": "user",
                         "content": [
                             {
-                                "type": "text",
+                                "type": "input_text",
                                 "text": prompt
                             },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
-                            }
+                            image_part
                         ]
                     }
                 ],
-                max_tokens=1024,
+                max_output_tokens=1024,
                 temperature=1
             )
+            parsed = reply.model_dump()
+            print(f"[DEBUG] Parsed analysis: {parsed}")
+            return parsed
+        except StructuredOutputError as e:
+            print(f"[DEBUG] Error parsing response: {str(e)}")
         except Exception as e:
             print(f"[DEBUG] Error in analyze_image: {str(e)}")
             raise
         
-        # Parse the response
-        try:
-            result_text = response.choices[0].message.content
-            print(f"[DEBUG] Raw OpenAI response: {result_text}")
-            
-            # Try to extract JSON from the response
-            start_idx = result_text.find("{")
-            end_idx = result_text.rfind("}") + 1
-            if start_idx != -1 and end_idx > start_idx:
-                json_str = result_text[start_idx:end_idx]
-                print(f"[DEBUG] Extracted JSON: {json_str}")
-                parsed = json.loads(json_str)
-                print(f"[DEBUG] Successfully parsed JSON with keys: {list(parsed.keys())}")
-                return parsed
-            else:
-                print(f"[DEBUG] No JSON found in response")
-        except Exception as e:
-            print(f"[DEBUG] Error parsing response: {type(e).__name__}: {str(e)}")
-        
         # Fallback
         return {
             "item_name": "Unknown Item",
@@ -101,9 +207,96 @@ class OpenAIClient:
             "key_features": []
         }
     
-    async def generate_listing(self, item_data: Dict[str, Any], price_data: Dict[str, Any]) -> str:
-        """Generate optimized listing description using GPT-4."""
+    async def analyze_and_write_listing(self, image: Union[ImageInput, VisionImage],
+                                        on_field: Optional[FieldCallback] = None) -> Optional[Dict[str, Any]]:
+        """Identify the item, estimate its price and write its listing in one call.
+        
+        The reply is constrained to ItemListingReply. Returns None if it can't
+        be parsed even after repair, so callers can fall back to analyze_image
+        followed by generate_listing. `on_field` streams the reply as in
+        `analyze_image`.
+        """
+        
+        print("[DEBUG] Starting one-shot analysis and listing")
+        
+        vision_image = await self.prepare_vision_image(image)
+        key = fingerprint("item_listing", settings.openai_model, vision_image.data)
+        return await self._coalesced(key, lambda: self._analyze_and_write_listing(vision_image, on_field), on_field)
+    
+    async def _analyze_and_write_listing(self, vision_image: VisionImage,
+                                         on_field: Optional[FieldCallback]) -> Optional[Dict[str, Any]]:
+        prompt = """Analyze this item for resale and write its marketplace listing.
+        
+        Identify the item (name, general category, visible brand and model, condition
+        as new/like new/good/fair/poor, top 3-5 key features, color, size, material).
         
+        For estimated_price, give a fair used/resale market value in whole USD based on
+        the item type, brand, model and the condition you observe, as on eBay or
+        Facebook Marketplace.
+        
+        Then write the listing:
+        - title: attention-grabbing, max 80 characters
+        - description: key features and benefits, condition details and why someone
+          should buy it, with SEO keywords integrated naturally
+        - keywords: 5-10 search keywords
+        
+        Use null for anything you can't determine."""
+        
+        # Inline for the same reason as _analyze_image (the call is shared)
+        image_part = vision_image.input_part()
+        
+        try:
+            reply = await create_structured(
+                self.client,
+                "item_listing",
+                ItemListingReply,
+                priority=PRIORITY_INTERACTIVE,
+                on_field=on_field,
+                instructions="You are an expert at identifying second-hand items and creating compelling product listings that sell. You understand SEO and marketplace best practices.",
+                input=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "input_text",
+                                "text": prompt
+                            },
+                            image_part
+                        ]
+                    }
+                ],
+                max_output_tokens=2048,
+                temperature=1
+            )
+        except StructuredOutputError as e:
+            print(f"[DEBUG] Error parsing one-shot response: {str(e)}")
+            return None
+        except Exception as e:
+            print(f"[DEBUG] Error in analyze_and_write_listing: {str(e)}")
+            raise
+        
+        return reply.model_dump()
+    
+    async def generate_listing(self, item_data: Dict[str, Any], price_data: Dict[str, Any],
+                               on_field: Optional[FieldCallback] = None,
+                               on_partial: Optional[FieldCallback] = None) -> Dict[str, Any]:
+        """Generate optimized listing title, description and keywords using GPT-4.
+        
+        Raises StructuredOutputError if the reply can't be parsed even after repair.
+        Passing `on_field`/`on_partial` streams the reply (title first); see
+        `create_structured`. Concurrent calls for the same item and prices
+        share one request.
+        """
+        
+        key = fingerprint("listing", settings.openai_model, item_data, price_data)
+        return await self._coalesced(
+            key, lambda: self._generate_listing(item_data, price_data, on_field, on_partial),
+            on_field, on_partial
+        )
+    
+    async def _generate_listing(self, item_data: Dict[str, Any], price_data: Dict[str, Any],
+                                on_field: Optional[FieldCallback],
+                                on_partial: Optional[FieldCallback]) -> Dict[str, Any]:
         prompt = f"""Create a compelling product listing description for online marketplaces.
 
 Item Details:
@@ -120,35 +313,28 @@ Create a listing that includes:
 4. Why someone should buy this item
 5. SEO-optimized keywords naturally integrated
 
-Format the response as:
-TITLE: [title here]
-
-DESCRIPTION:
-[full description here]
-
-KEYWORDS: [comma-separated keywords]"""
+Return the title, the full description and 5-10 keywords."""
         
-        response = self.client.chat.completions.create(
-            model=settings.openai_model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert at creating compelling product listings that sell. You understand SEO and marketplace best practices."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            max_tokens=1024,
+        reply = await create_structured(
+            self.client,
+            "listing",
+            ListingTextReply,
+            priority=PRIORITY_INTERACTIVE,
+            on_field=on_field,
+            on_partial=on_partial,
+            instructions="You are an expert at creating compelling product listings that sell. You understand SEO and marketplace best practices.",
+            input=prompt,
+            max_output_tokens=1024,
             temperature=1
         )
         
-        return response.choices[0].message.content
+        return reply.model_dump()
     
-    async def generate_marketing_prompts(self, item_data: Dict[str, Any], base64_image: str) -> List[Dict[str, str]]:
+    async def generate_marketing_prompts(self, item_data: Dict[str, Any], image: Union[ImageInput, VisionImage]) -> List[Dict[str, str]]:
         """Generate 5 ultra-memey marketing prompts for FLUX - peak AI slop aesthetic."""
         
+        image_part = await self.image_input_part(image)
+        
         prompt = f"""You are a meme lord creating the most absurd, over-the-top product marketing images. 
 Generate 5 FLUX.1 Kontext prompts for a {item_data['item_name']} ({item_data['category']}) that are:
 
@@ -167,57 +353,40 @@ Item details:
 - Brand: {item_data.get('brand', 'generic')}
 - Key features: {', '.join(item_data.get('key_features', []))}
 
-Return a JSON array with 5 objects, each containing:
-{{
-    "title": "Catchy meme title",
-    "prompt": "Full FLUX prompt with all details",
-    "style": "meme style (e.g., 'apocalyptic', 'motivational', 'cinematic')"
-}}
+Return 5 prompts, each with:
+- title: catchy meme title
+- prompt: full FLUX prompt with all details
+- style: meme style (e.g., 'apocalyptic', 'motivational', 'cinematic')
 
 Make each prompt detailed and specific for FLUX.1 Kontext. Go absolutely wild."""
 
-        response = self.client.chat.completions.create(
-            model=settings.openai_model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert at creating viral, meme-worthy marketing content. You understand internet culture and how to make absurdist humor work."
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=2048,
-            temperature=1.2  # Higher temperature for more creative/wild outputs
-        )
-        
         try:
-            result_text = response.choices[0].message.content
-            print(f"[DEBUG] Marketing prompts response: {result_text}")
-            
-            # Extract JSON
-            start_idx = result_text.find("[")
-            end_idx = result_text.rfind("]") + 1
-            if start_idx != -1 and end_idx > start_idx:
-                json_str = result_text[start_idx:end_idx]
-                prompts = json.loads(json_str)
-                return prompts
-            else:
-                raise ValueError("No JSON array found in response")
+            reply = await create_structured(
+                self.client,
+                "marketing_prompts",
+                MarketingPromptsReply,
+                priority=PRIORITY_BACKGROUND,
+                instructions="You are an expert at creating viral, meme-worthy marketing content. You understand internet culture and how to make absurdist humor work.",
+                input=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "input_text",
+                                "text": prompt
+                            },
+                            image_part
+                        ]
+                    }
+                ],
+                max_output_tokens=2048,
+                temperature=1.2  # Higher temperature for more creative/wild outputs
+            )
+            prompts = [p.model_dump() for p in reply.prompts]
+            print(f"[DEBUG] Marketing prompts: {prompts}")
+            return prompts
                 
-        except Exception as e:
+        except StructuredOutputError as e:
             print(f"[DEBUG] Error parsing marketing prompts: {str(e)}")
             # Fallback to generic meme prompts
             return [
@@ -258,7 +427,9 @@ Brand: {brand if brand else 'Unknown'}
 Create specific search queries that would help find this exact item or very similar items on marketplace websites like eBay, Facebook Marketplace, or Craigslist.
 Return only the queries, one per line, no numbering or bullets."""
         
-        response = self.client.chat.completions.create(
+        response = await scheduled(
+            self.client.chat.completions.create,
+            PRIORITY_STANDARD,
             model=settings.openai_model,
             messages=[
                 {
@@ -291,7 +462,9 @@ Market Insights:
 Add a brief section at the end of the description mentioning why now is a good time to buy based on the market insights.
 Keep the same format (TITLE, DESCRIPTION, KEYWORDS) but enhance the description."""
         
-        response = self.client.chat.completions.create(
+        response = await scheduled(
+            self.client.chat.completions.create,
+            PRIORITY_STANDARD,
             model=settings.openai_model,
             messages=[
                 {
@@ -304,105 +477,3 @@ Keep the same format (TITLE, DESCRIPTION, KEYWORDS) but enhance the description.
         )
         
         return response.choices[0].message.content
-    
-    async def generate_marketing_prompts(self, item_data: Dict[str, Any], base64_image: str) -> List[Dict[str, str]]:
-        """Generate 5 ultra-memey marketing prompts for FLUX - peak AI slop aesthetic."""
-        
-        prompt = f"""You are a meme lord creating the most absurd, over-the-top product marketing images. 
-Generate 5 FLUX.1 Kontext prompts for a {item_data['item_name']} ({item_data['category']}) that are:
-
-- Completely unhinged and surreal
-- Mix mundane product use with epic/apocalyptic scenarios  
-- Include popular meme formats and internet culture
-- So extra that they're obviously AI-generated
-- Dramatic lighting, explosions, impossible physics
-- Celebrity/movie references welcome
-- Think "stock photo gone wrong" energy
-- Use cinematic keywords: 8k, hyperrealistic, dramatic lighting, epic composition, octane render
-
-Item details:
-- Name: {item_data['item_name']}
-- Category: {item_data['category']}
-- Brand: {item_data.get('brand', 'generic')}
-- Key features: {', '.join(item_data.get('key_features', []))}
-
-Return a JSON array with 5 objects, each containing:
-{{
-    "title": "Catchy meme title",
-    "prompt": "Full FLUX prompt with all details",
-    "style": "meme style (e.g., 'apocalyptic', 'motivational', 'cinematic')"
-}}
-
-Make each prompt detailed and specific for FLUX.1 Kontext. Go absolutely wild."""
-
-        response = self.client.chat.completions.create(
-            model=settings.openai_model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert at creating viral, meme-worthy marketing content. You understand internet culture and how to make absurdist humor work."
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=2048,
-            temperature=1.2  # Higher temperature for more creative/wild outputs
-        )
-        
-        try:
-            result_text = response.choices[0].message.content
-            print(f"[DEBUG] Marketing prompts response: {result_text}")
-            
-            # Extract JSON
-            start_idx = result_text.find("[")
-            end_idx = result_text.rfind("]") + 1
-            if start_idx != -1 and end_idx > start_idx:
-                json_str = result_text[start_idx:end_idx]
-                prompts = json.loads(json_str)
-                return prompts
-            else:
-                raise ValueError("No JSON array found in response")
-                
-        except Exception as e:
-            print(f"[DEBUG] Error parsing marketing prompts: {str(e)}")
-            # Fallback to generic meme prompts
-            return [
-                {
-                    "title": "Grindset Mindset",
-                    "prompt": f"{item_data['item_name']} floating in space with explosions, dramatic lighting, 'SUCCESS' text in flames, 8k hyperrealistic",
-                    "style": "motivational"
-                },
-                {
-                    "title": "Apocalypse Mode",
-                    "prompt": f"Person using {item_data['item_name']} during zombie apocalypse, determined expression, sunrise through ruins, dramatic composition",
-                    "style": "apocalyptic"
-                },
-                {
-                    "title": "Quantum Dimension",
-                    "prompt": f"{item_data['item_name']} creating portal to another dimension, swirling colors, impossible physics, cinematic lighting",
-                    "style": "surreal"
-                },
-                {
-                    "title": "Celebrity Endorsement Gone Wrong",
-                    "prompt": f"Famous person dramatically using {item_data['item_name']}, paparazzi in background, luxury setting, chaos ensuing",
-                    "style": "celebrity"
-                },
-                {
-                    "title": "Epic Battle",
-                    "prompt": f"{item_data['item_name']} in medieval battle scene, knights cheering, dragon in background, epic movie poster style",
-                    "style": "cinematic"
-                }
-            ]
\ No newline at end of file
@@ -0,0 +1,236 @@
+import asyncio
+import heapq
+import itertools
+import random
+import re
+from typing import Dict, Any, Optional, Callable, Awaitable, TypeVar
+import openai
+from app.config import settings
+
+T = TypeVar("T")
+
+# Priority lanes: lower runs first
+PRIORITY_INTERACTIVE = 0  # Analysis and listing text a user is waiting on
+PRIORITY_STANDARD = 1
+PRIORITY_BACKGROUND = 2  # Decorative extras such as meme prompts
+
+# Rough budget for one image input (detail "auto" at the vision max edge)
+IMAGE_TOKEN_ESTIMATE = 800
+
+
+def estimate_request_tokens(request: Dict[str, Any]) -> int:
+    """Rough token cost of a request: ~4 characters per token, a flat cost per image, plus the output cap."""
+    counts = {"chars": 0, "images": 0}
+
+    def walk(node: Any):
+        if isinstance(node, str):
+            counts["chars"] += len(node)
+        elif isinstance(node, dict):
+            if node.get("type") in ("input_image", "image_url"):
+                counts["images"] += 1
+                return
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+
+    for key in ("instructions", "input", "messages"):
+        walk(request.get(key))
+    if "input" not in request and "messages" not in request:
+        # Not a model call (e.g. Files uploads): counts against requests/min only
+        return counts["chars"] // 4
+    output_tokens = request.get("max_output_tokens") or request.get("max_tokens") or 1024
+    return counts["chars"] // 4 + counts["images"] * IMAGE_TOKEN_ESTIMATE + output_tokens
+
+
+def _parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds from a rate-limit header: plain seconds or forms like "6m0s", "120ms"."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    units = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously up to `capacity`."""
+
+    def __init__(self, capacity: float, per_second: float):
+        self.capacity = capacity
+        self.rate = per_second
+        self.level = capacity
+        self.updated: Optional[float] = None
+
+    def _refill(self, now: float):
+        if self.updated is not None:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float, now: float) -> float:
+        self._refill(now)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float, now: float):
+        self._refill(now)
+        self.level -= amount
+
+    def adjust(self, extra: float):
+        """Charge (or refund, if negative) the difference from an earlier estimate."""
+        self.level = min(self.capacity, self.level - extra)
+
+
+class OpenAIScheduler:
+    """Admits OpenAI calls against shared requests/min and tokens/min budgets.
+
+    Waiting calls are admitted strictly by priority lane, FIFO within a lane.
+    A 429 pauses every lane until the time given by the rate-limit headers;
+    429s, connection errors and 5xx responses are retried with backoff.
+    """
+
+    def __init__(self,
+                 requests_per_minute: int,
+                 tokens_per_minute: int,
+                 max_retries: int,
+                 backoff_max: float):
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+        self.max_retries = max_retries
+        self.backoff_max = backoff_max
+
+        self._waiting: list = []
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    async def run(self,
+                  call: Callable[[], Awaitable[T]],
+                  priority: int = PRIORITY_STANDARD,
+                  estimated_tokens: int = 1024) -> T:
+        """Run `call()` once the budgets allow, retrying throttled or failed attempts."""
+        attempt = 0
+        while True:
+            await self._acquire(priority, estimated_tokens)
+            try:
+                result = await call()
+            except openai.RateLimitError as e:
+                if getattr(e, "code", None) == "insufficient_quota" or attempt >= self.max_retries:
+                    raise
+                delay = self._rate_limit_delay(e, attempt)
+                self._pause(delay)
+                error = e
+            except (openai.APIConnectionError, openai.InternalServerError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                error = e
+            else:
+                usage = getattr(result, "usage", None)
+                total_tokens = getattr(usage, "total_tokens", None)
+                if isinstance(total_tokens, int):
+                    self.tokens.adjust(total_tokens - estimated_tokens)
+                return result
+
+            attempt += 1
+            print(f"[DEBUG] OpenAI call failed ({type(error).__name__}), retry {attempt} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    def _backoff(self, attempt: int) -> float:
+        return min(self.backoff_max, 2 ** attempt) * random.uniform(0.8, 1.2)
+
+    def _rate_limit_delay(self, error: openai.RateLimitError, attempt: int) -> float:
+        headers = error.response.headers if error.response is not None else {}
+        retry_after_ms = _parse_duration(headers.get("retry-after-ms"))
+        delay = retry_after_ms / 1000 if retry_after_ms is not None else _parse_duration(headers.get("retry-after"))
+
+        if delay is None:
+            # Wait for whichever budget ran out to reset
+            resets = []
+            if headers.get("x-ratelimit-remaining-requests") == "0":
+                resets.append(_parse_duration(headers.get("x-ratelimit-reset-requests")))
+            if headers.get("x-ratelimit-remaining-tokens") == "0":
+                resets.append(_parse_duration(headers.get("x-ratelimit-reset-tokens")))
+            resets = [r for r in resets if r is not None]
+            delay = max(resets) if resets else None
+
+        if delay is None:
+            return self._backoff(attempt)
+        return min(self.backoff_max, delay) + random.uniform(0, 0.25)
+
+    def _pause(self, delay: float):
+        loop = asyncio.get_running_loop()
+        self._paused_until = max(self._paused_until, loop.time() + delay)
+
+    async def _acquire(self, priority: int, tokens: int):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # A single request larger than the bucket would otherwise never fit
+        heapq.heappush(self._waiting, (priority, next(self._seq), min(tokens, self.tokens.capacity), future))
+
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        self._wakeup.set()
+        await future
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            # Skip callers that gave up while waiting
+            while self._waiting and self._waiting[0][3].done():
+                heapq.heappop(self._waiting)
+            if not self._waiting:
+                return
+
+            _, _, tokens, future = self._waiting[0]
+            now = loop.time()
+            wait = max(
+                self._paused_until - now,
+                self.requests.time_until(1, now),
+                self.tokens.time_until(tokens, now)
+            )
+            if wait <= 0:
+                heapq.heappop(self._waiting)
+                self.requests.take(1, now)
+                self.tokens.take(tokens, now)
+                future.set_result(None)
+                continue
+
+            try:
+                # Sleep until the budget allows the head call, or a new caller arrives
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def scheduled(create: Callable[..., Awaitable[T]], priority: int = PRIORITY_STANDARD, **request) -> T:
+    """Call `create(**request)` (e.g. client.responses.create) through the shared scheduler."""
+    return await get_shared_scheduler().run(
+        lambda: create(**request), priority, estimate_request_tokens(request)
+    )
+
+
+_shared_scheduler: Optional[OpenAIScheduler] = None
+
+
+def get_shared_scheduler() -> OpenAIScheduler:
+    """Return the process-wide scheduler every OpenAI call goes through."""
+    global _shared_scheduler
+    if _shared_scheduler is None:
+        _shared_scheduler = OpenAIScheduler(
+            requests_per_minute=settings.openai_requests_per_minute,
+            tokens_per_minute=settings.openai_tokens_per_minute,
+            max_retries=settings.openai_max_retries,
+            backoff_max=settings.openai_retry_backoff_max
+        )
+    return _shared_scheduler
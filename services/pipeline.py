@@ -0,0 +1,140 @@
+from typing import Dict, Any, List, Callable, Awaitable, Tuple
+from dataclasses import dataclass, field
+import asyncio
+import time
+
+
+@dataclass
+class Stage:
+    """A single step of a pipeline.
+
+    `func` is called with one keyword argument per name in `inputs`. A stage
+    with a single output returns that value directly; a stage with several
+    outputs (or any emits) returns a dict keyed by output name.
+
+    Values in `emits` can be published before the stage finishes: the stage
+    is also passed an `emit(key, value)` callable, and dependants of an
+    emitted value start as soon as it is published. An emitted value that
+    was never published is taken from the returned dict instead.
+    """
+
+    name: str
+    func: Callable[..., Awaitable[Any]]
+    inputs: List[str] = field(default_factory=list)
+    outputs: List[str] = field(default_factory=list)
+    emits: List[str] = field(default_factory=list)
+
+
+class StagePipeline:
+    """Runs a DAG of async stages, starting each one as soon as its inputs exist."""
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = stages
+        self._producers: Dict[str, str] = {}
+
+        for stage in stages:
+            for output in stage.outputs + stage.emits:
+                if output in self._producers:
+                    raise ValueError(
+                        f"Output '{output}' is produced by both "
+                        f"'{self._producers[output]}' and '{stage.name}'"
+                    )
+                self._producers[output] = stage.name
+
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        """Reject stage graphs with dependency cycles."""
+        by_name = {stage.name: stage for stage in self.stages}
+        visiting, done = set(), set()
+
+        def visit(name: str):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Dependency cycle through stage '{name}'")
+            visiting.add(name)
+            for key in by_name[name].inputs:
+                producer = self._producers.get(key)
+                if producer:
+                    visit(producer)
+            visiting.discard(name)
+            done.add(name)
+
+        for stage in self.stages:
+            visit(stage.name)
+
+    async def run(self, **initial: Any) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Run every stage and return (values, timings).
+
+        `initial` seeds values that no stage produces (e.g. the raw upload).
+        Timings are milliseconds relative to the start of the run, keyed by
+        stage name under "stages", plus the wall-clock "total_ms".
+        """
+        loop = asyncio.get_running_loop()
+        values: Dict[str, asyncio.Future] = {}
+
+        for key, value in initial.items():
+            values[key] = loop.create_future()
+            values[key].set_result(value)
+
+        for stage in self.stages:
+            for key in stage.inputs:
+                if key not in values and key not in self._producers:
+                    raise ValueError(f"Stage '{stage.name}' needs missing input '{key}'")
+            for key in stage.outputs + stage.emits:
+                values[key] = loop.create_future()
+
+        started = time.perf_counter()
+        timings: Dict[str, Dict[str, float]] = {}
+
+        def elapsed_ms() -> float:
+            return round((time.perf_counter() - started) * 1000, 1)
+
+        def make_emit(stage: Stage):
+            def emit(key: str, value: Any):
+                if key not in stage.emits:
+                    raise ValueError(f"Stage '{stage.name}' does not emit '{key}'")
+                if not values[key].done():
+                    values[key].set_result(value)
+            return emit
+
+        async def run_stage(stage: Stage):
+            kwargs = {key: await values[key] for key in stage.inputs}
+            if stage.emits:
+                kwargs["emit"] = make_emit(stage)
+            start_ms = elapsed_ms()
+            try:
+                result = await stage.func(**kwargs)
+            finally:
+                end_ms = elapsed_ms()
+                timings[stage.name] = {
+                    "start_ms": start_ms,
+                    "end_ms": end_ms,
+                    "duration_ms": round(end_ms - start_ms, 1),
+                }
+
+            if len(stage.outputs) == 1 and not stage.emits:
+                values[stage.outputs[0]].set_result(result)
+            else:
+                for key in stage.outputs:
+                    values[key].set_result(result[key])
+                for key in stage.emits:
+                    if not values[key].done():
+                        if key not in result:
+                            raise ValueError(f"Stage '{stage.name}' never emitted '{key}'")
+                        values[key].set_result(result[key])
+
+        tasks = [asyncio.create_task(run_stage(stage), name=stage.name) for stage in self.stages]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        return (
+            {key: future.result() for key, future in values.items()},
+            {"total_ms": elapsed_ms(), "stages": timings},
+        )
@@ -0,0 +1,72 @@
+from typing import List, Optional
+from pydantic import BaseModel
+
+
+# Reply shapes for the structured LLM calls (see services/structured_output.py)
+
+
+class ItemAnalysisReply(BaseModel):
+    item_name: str
+    category: str
+    brand: Optional[str] = None
+    condition: str
+    key_features: List[str] = []
+    estimated_price: int
+
+
+class ListingTextReply(BaseModel):
+    title: str
+    description: str
+    keywords: List[str] = []
+
+
+class ItemListingReply(BaseModel):
+    item_name: str
+    category: str
+    brand: Optional[str] = None
+    model: Optional[str] = None
+    condition: str
+    key_features: List[str] = []
+    color: Optional[str] = None
+    size: Optional[str] = None
+    material: Optional[str] = None
+    estimated_price: int
+    title: str
+    description: str
+    keywords: List[str] = []
+
+
+class MarketingPrompt(BaseModel):
+    title: str
+    prompt: str
+    style: str
+
+
+class MarketingPromptsReply(BaseModel):
+    prompts: List[MarketingPrompt]
+
+
+class VariationPromptReply(BaseModel):
+    title: str
+    prompt: str
+    context: str
+
+
+class RecommendedShot(BaseModel):
+    type: str
+    description: str
+    prompt_elements: List[str] = []
+    priority: str
+
+
+class StylingRecommendations(BaseModel):
+    backgrounds: List[str] = []
+    lighting: str
+    props: List[str] = []
+    mood: str
+
+
+class ImageRecommendationsReply(BaseModel):
+    recommended_shots: List[RecommendedShot]
+    styling_recommendations: StylingRecommendations
+    category_insights: str
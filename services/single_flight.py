@@ -0,0 +1,83 @@
+import asyncio
+import copy
+import hashlib
+import json
+from typing import Dict, Any, Callable, Awaitable, TypeVar
+from app.config import settings
+
+T = TypeVar("T")
+
+
+def fingerprint(*parts: Any) -> str:
+    """Stable hash of a request's parts; bytes are hashed, dicts compared key-order-free."""
+    def normalize(value: Any) -> Any:
+        if isinstance(value, (bytes, bytearray)):
+            return {"sha256": hashlib.sha256(value).hexdigest()}
+        return value
+
+    normalized = json.dumps([normalize(p) for p in parts], sort_keys=True, default=str)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """One shared call and the number of callers still waiting on it."""
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent identical calls into one upstream request.
+
+    The first caller for a key starts `call()`; callers arriving with the
+    same key while it is in flight await the same task. Each caller gets
+    its own deep copy of the result (callers mutate what they get back),
+    and an error is raised to all of them. One caller going away doesn't
+    cancel the shared call for the rest, but once every caller has gone
+    it is cancelled, so abandoned upstream work stops.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, _Flight] = {}
+        self.calls = 0
+        self.shared = 0
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._inflight
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+
+    async def do(self, key: str, call: Callable[[], Awaitable[T]]) -> T:
+        self.calls += 1
+        if not settings.single_flight_enabled:
+            return await call()
+
+        flight = self._inflight.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(call()))
+            self._inflight[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            self.shared += 1
+            print(f"[DEBUG] Joining in-flight {self.name} call {key[:12]}")
+
+        flight.waiters += 1
+        try:
+            # Shielded so a cancelled caller only stops waiting
+            result = await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Every caller is gone: stop the upstream work, and let a
+                # later caller start afresh instead of joining the cancelled task
+                flight.task.cancel()
+                self._forget(key, flight)
+        return copy.deepcopy(result)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._inflight)}
+
@@ -1,15 +1,19 @@
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Optional, Union
 import asyncio
 import httpx
 from PIL import Image
 from io import BytesIO
 import os
 import uuid
-from services.bfl_client import BFLClient
+from services.bfl_client import BFLClient, PreparedImage
+from services.image_enhancer import BACKGROUND_REMOVAL_PROMPT
 from services.image_insights import ImageInsightsService
 from services.openai_client import OpenAIClient
+from services.vision_preprocessor import VisionImage
+from services.response_schemas import VariationPromptReply
+from services.structured_output import create_structured, StructuredOutputError
+from services.openai_scheduler import PRIORITY_BACKGROUND
 from services.item_analyzer import ItemAnalyzer
-from app.config import settings
 
 
 class SmartImageGenerator:
@@ -29,8 +33,18 @@ class SmartImageGenerator:
         item_analysis: Dict[str, Any],
         enhancement_mode: str = "smart",
         progress_callback=None,
+        clean_image: Optional[Dict[str, Any]] = None,
     ) -> Dict[str, Any]:
-        """Generate a complete portfolio of listing images."""
+        """Generate a complete portfolio of listing images.
+
+        `progress_callback(event, data)` is called with "stage" events
+        ({"message": ...}), an "image" event for each image as soon as it is
+        saved, and "error" events for images that failed.
+
+        `clean_image` is a result of `generate_clean_image` that the caller
+        already started (e.g. while analysis was still running); when given,
+        smart mode reuses it instead of generating the clean shot again.
+        """
 
         result = {
             "mode": enhancement_mode,
@@ -40,40 +54,41 @@ class SmartImageGenerator:
             "errors": [],
         }
 
-        def update_progress(msg):
+        def report(event, data):
             if progress_callback:
-                progress_callback(msg)
+                progress_callback(event, data)
+
+        def update_progress(msg):
+            report("stage", {"message": msg})
 
         if enhancement_mode == "quick":
             # Just do background removal
+            update_progress("Generating clean product image...")
             enhanced_image, path = await self._quick_enhance(original_image)
-            result["generated_images"].append(
-                {
-                    "type": "background_removal",
-                    "description": "Clean white background",
-                    "path": path,
-                    "url": f"/image/{os.path.basename(path)}",
-                }
-            )
+            image = {
+                "type": "background_removal",
+                "description": "Clean white background",
+                "path": path,
+                "url": f"/image/{os.path.basename(path)}",
+            }
+            result["generated_images"].append(image)
+            report("image", image)
 
         elif enhancement_mode == "smart":
             # Full AI-driven portfolio generation
 
             # First, generate a clean background image
-            update_progress("Generating clean product image...")
-            clean_image_data = None
-            try:
-                clean_image_data, clean_path = await self._quick_enhance(original_image)
-                result["generated_images"].append(
-                    {
-                        "type": "background_removal",
-                        "description": "Clean white background",
-                        "path": clean_path,
-                        "url": f"/image/{os.path.basename(clean_path)}",
-                    }
-                )
-            except Exception as e:
-                result["errors"].append(f"Clean image generation failed: {str(e)}")
+            if clean_image is None:
+                update_progress("Generating clean product image...")
+                clean_image = await self.generate_clean_image(original_image)
+
+            clean_image_data = clean_image["data"]
+            if clean_image["image"]:
+                result["generated_images"].append(clean_image["image"])
+                report("image", clean_image["image"])
+            if clean_image["error"]:
+                result["errors"].append(clean_image["error"])
+                report("error", {"message": clean_image["error"]})
 
             # Then generate marketing images using the clean image if available
             update_progress("Creating viral marketing images...")
@@ -83,7 +98,7 @@ class SmartImageGenerator:
                     clean_image_data if clean_image_data else original_image
                 )
                 marketing_result = await self.generate_marketing_portfolio(
-                    marketing_source, item_analysis
+                    marketing_source, item_analysis, progress_callback
                 )
 
                 # Add marketing images to results
@@ -100,15 +115,40 @@ class SmartImageGenerator:
 
             except Exception as e:
                 result["errors"].append(f"Marketing image generation failed: {str(e)}")
+                report("error", {"message": result["errors"][-1]})
 
         return result
 
+    async def generate_clean_image(self, original_image: bytes) -> Dict[str, Any]:
+        """Generate the clean white-background shot that smart mode builds on.
+
+        Only needs the raw upload, so it can run before item analysis is done.
+        Failures are reported in "error" rather than raised.
+        """
+        try:
+            clean_data, clean_path = await self._quick_enhance(original_image)
+        except Exception as e:
+            return {
+                "data": None,
+                "image": None,
+                "error": f"Clean image generation failed: {str(e)}",
+            }
+
+        return {
+            "data": clean_data,
+            "image": {
+                "type": "background_removal",
+                "description": "Clean white background",
+                "path": clean_path,
+                "url": f"/image/{os.path.basename(clean_path)}",
+            },
+            "error": None,
+        }
+
     async def _quick_enhance(self, image_data: bytes) -> Tuple[bytes, str]:
         """Quick enhancement with just background removal."""
-        prompt = "Product on clean white background, professional lighting, centered composition"
-
         enhanced_data = await self.bfl_client.generate_image_edit(
-            image_data, prompt=prompt
+            image_data, prompt=BACKGROUND_REMOVAL_PROMPT
         )
 
         filename = f"enhanced_{uuid.uuid4()}.png"
@@ -121,7 +161,7 @@ class SmartImageGenerator:
 
     async def _generate_single_image(
         self,
-        original_image: bytes,
+        original_image: Union[bytes, PreparedImage],
         prompt_data: Dict[str, str],
         item_analysis: Dict[str, Any],
     ) -> Dict[str, Any]:
@@ -152,14 +192,8 @@ class SmartImageGenerator:
         except Exception as e:
             raise Exception(f"Failed to generate {prompt_data['type']} image: {str(e)}")
 
-    def _encode_image(self, image_data: bytes) -> str:
-        """Encode image to base64."""
-        import base64
-
-        return base64.b64encode(image_data).decode("utf-8")
-
     async def _generate_single_variation_prompt(
-        self, item_analysis: Dict[str, Any], base64_image: str, index: int
+        self, item_analysis: Dict[str, Any], vision_image: VisionImage, index: int
     ) -> Dict[str, str]:
         """Generate a single meme variation prompt using OpenAI."""
 
@@ -213,45 +247,34 @@ Create a prompt that:
 3. Makes it meme-worthy and shareable
 4. Preserves product identity while changing ONLY the environment
 
-Return JSON:
-{{
-    "title": "Catchy meme title (5-7 words)",
-    "prompt": "Full FLUX Kontext prompt with preservation clauses",
-    "context": "{scenario['context']}"
-}}
+Return:
+- title: catchy meme title (5-7 words)
+- prompt: full FLUX Kontext prompt with preservation clauses
+- context: "{scenario['context']}"
 
 Make it ABSURDLY specific and viral-worthy!"""
 
-        response = self.openai_client.client.chat.completions.create(
-            model=settings.openai_model,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            },
-                        },
-                    ],
-                }
-            ],
-            temperature=1.3,
-            max_tokens=300,
-        )
-
+        image_part = await self.openai_client.image_input_part(vision_image)
         try:
-            result_text = response.choices[0].message.content
-            # Extract JSON
-            start_idx = result_text.find("{")
-            end_idx = result_text.rfind("}") + 1
-            if start_idx != -1 and end_idx > start_idx:
-                import json
-
-                return json.loads(result_text[start_idx:end_idx])
-        except Exception as e:
+            reply = await create_structured(
+                self.openai_client.client,
+                "variation_prompt",
+                VariationPromptReply,
+                priority=PRIORITY_BACKGROUND,
+                input=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "input_text", "text": prompt},
+                            image_part,
+                        ],
+                    }
+                ],
+                temperature=1.3,
+                max_output_tokens=300,
+            )
+            return reply.model_dump()
+        except StructuredOutputError as e:
             print(f"[DEBUG] Error parsing variation prompt: {str(e)}")
 
         # Fallback prompt
@@ -266,8 +289,17 @@ Make it ABSURDLY specific and viral-worthy!"""
         original_image: bytes,
         custom_prompts: List[str],
         use_enhanced: bool = True,
+        progress_callback=None,
     ) -> Dict[str, Any]:
-        """Generate images with custom user-provided prompts."""
+        """Generate images with custom user-provided prompts.
+
+        `progress_callback(event, data)` gets an "image" or "error" event as
+        each prompt finishes.
+        """
+
+        def report(event, data):
+            if progress_callback:
+                progress_callback(event, data)
 
         # Try to enhance the source image first if requested
         source_image = original_image
@@ -280,6 +312,9 @@ Make it ABSURDLY specific and viral-worthy!"""
             except Exception as e:
                 print(f"[DEBUG] Enhancement failed, using original: {str(e)}")
 
+        # Compress and encode the source once for every prompt
+        prepared_source = await self.bfl_client.prepare_image(source_image)
+
         results = []
         for i, prompt in enumerate(custom_prompts):
             try:
@@ -291,9 +326,10 @@ Make it ABSURDLY specific and viral-worthy!"""
                 }
 
                 result = await self._generate_single_image(
-                    source_image, prompt_data, {}
+                    prepared_source, prompt_data, {}
                 )
                 results.append(result)
+                report("image", result)
 
             except Exception as e:
                 results.append(
@@ -305,6 +341,7 @@ Make it ABSURDLY specific and viral-worthy!"""
                         "error": str(e),
                     }
                 )
+                report("error", {"message": str(e)})
 
         return {
             "mode": "custom",
@@ -322,90 +359,99 @@ Make it ABSURDLY specific and viral-worthy!"""
         print("[DEBUG] Starting meme variation generation")
 
         # First analyze the image to understand what we're working with
-        temp_path = f"uploads/temp_variation_{uuid.uuid4()}.jpg"
-        os.makedirs("uploads", exist_ok=True)
-        with open(temp_path, "wb") as f:
-            f.write(image_data)
-
-        try:
-            # Get basic item analysis
-            item_analysis = await self.analyzer.analyze_item(temp_path)
-            print(f"[DEBUG] Analyzed item: {item_analysis['item_name']}")
-
-            # If requested and possible, enhance the image first for better variations
-            source_image = image_data
-            if use_enhanced:
-                try:
-                    print("[DEBUG] Generating clean enhanced image for variations")
-                    enhanced_data, _ = await self._quick_enhance(image_data)
-                    source_image = enhanced_data
-                    print("[DEBUG] Using enhanced image for variations")
-                except Exception as e:
-                    print(f"[DEBUG] Enhancement failed, using original: {str(e)}")
-
-            # Convert source image to base64 for OpenAI
-            base64_image = self._encode_image(source_image)
-
-            # Generate 3 meme prompts in parallel
-            prompt_tasks = []
-            for i in range(3):
-                task = self._generate_single_variation_prompt(
-                    item_analysis, base64_image, i
-                )
-                prompt_tasks.append(task)
+        item_analysis = await self.analyzer.analyze_item(image_data)
+        print(f"[DEBUG] Analyzed item: {item_analysis['item_name']}")
 
-            # Wait for all prompts
-            meme_prompts = await asyncio.gather(*prompt_tasks)
-            print(f"[DEBUG] Generated {len(meme_prompts)} meme prompts")
-            for i, mp in enumerate(meme_prompts):
-                print(
-                    f"[DEBUG] Prompt {i+1}: Title='{mp.get('title', 'N/A')}', Context='{mp.get('context', 'N/A')}'"
-                )
+        # If requested and possible, enhance the image first for better variations
+        source_image = image_data
+        if use_enhanced:
+            try:
+                print("[DEBUG] Generating clean enhanced image for variations")
+                enhanced_data, _ = await self._quick_enhance(image_data)
+                source_image = enhanced_data
+                print("[DEBUG] Using enhanced image for variations")
+            except Exception as e:
+                print(f"[DEBUG] Enhancement failed, using original: {str(e)}")
 
-            # Extract just the prompts for image generation
-            variation_prompts = [p["prompt"] for p in meme_prompts]
+        # Downsize once for the three OpenAI prompt calls
+        vision_image = await self.openai_client.prepare_vision_image(source_image)
 
-            # Generate all variations in parallel using the source image
-            variations = await self.bfl_client.generate_multiple_variations(
-                source_image, variation_prompts, self.enhanced_dir
+        # Generate 3 meme prompts in parallel
+        prompt_tasks = []
+        for i in range(3):
+            task = self._generate_single_variation_prompt(
+                item_analysis, vision_image, i
+            )
+            prompt_tasks.append(task)
+
+        # Wait for all prompts
+        meme_prompts = await asyncio.gather(*prompt_tasks)
+        print(f"[DEBUG] Generated {len(meme_prompts)} meme prompts")
+        for i, mp in enumerate(meme_prompts):
+            print(
+                f"[DEBUG] Prompt {i+1}: Title='{mp.get('title', 'N/A')}', Context='{mp.get('context', 'N/A')}'"
             )
 
-            # Add meme context to variations
-            for i, variation in enumerate(variations):
-                if i < len(meme_prompts) and not variation.get("error"):
-                    variation["meme_title"] = meme_prompts[i]["title"]
-                    variation["meme_context"] = meme_prompts[i]["context"]
-                    print(
-                        f"[DEBUG] Added meme data to variation {i+1}: {variation['meme_title']}"
-                    )
+        # Extract just the prompts for image generation
+        variation_prompts = [p["prompt"] for p in meme_prompts]
 
-            return {
-                "total_requested": len(variation_prompts),
-                "total_generated": len(
-                    [v for v in variations if v.get("error") is None]
-                ),
-                "variations": variations,
-            }
+        # Generate all variations in parallel using the source image
+        variations = await self.bfl_client.generate_multiple_variations(
+            source_image, variation_prompts, self.enhanced_dir
+        )
 
-        finally:
-            # Clean up temp file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+        # Add meme context to variations
+        for i, variation in enumerate(variations):
+            if i < len(meme_prompts) and not variation.get("error"):
+                variation["meme_title"] = meme_prompts[i]["title"]
+                variation["meme_context"] = meme_prompts[i]["context"]
+                print(
+                    f"[DEBUG] Added meme data to variation {i+1}: {variation['meme_title']}"
+                )
+
+        return {
+            "total_requested": len(variation_prompts),
+            "total_generated": len(
+                [v for v in variations if v.get("error") is None]
+            ),
+            "variations": variations,
+        }
 
     async def generate_marketing_portfolio(
-        self, original_image: bytes, item_analysis: Dict[str, Any]
+        self,
+        original_image: bytes,
+        item_analysis: Dict[str, Any],
+        progress_callback=None,
     ) -> Dict[str, Any]:
-        """Generate 5 ultra-memey marketing images for peak AI slop aesthetic."""
+        """Generate 5 ultra-memey marketing images for peak AI slop aesthetic.
 
-        print("[DEBUG] Starting marketing portfolio generation")
+        `progress_callback(event, data)` gets an "image" event as soon as each
+        image is saved and an "error" event for each one that fails.
+        """
+
+        def report(event, data):
+            if progress_callback:
+                progress_callback(event, data)
+
+        async def generate_and_report(prompt_data, full_prompt_data):
+            try:
+                image = await self._generate_single_image(
+                    prepared_source, full_prompt_data, item_analysis
+                )
+            except Exception as e:
+                report("error", {"message": str(e)})
+                raise
+            # Add the meme title to the result
+            image["meme_title"] = prompt_data["title"]
+            report("image", image)
+            return image
 
-        # Convert image to base64 for OpenAI
-        base64_image = self._encode_image(original_image)
+        print("[DEBUG] Starting marketing portfolio generation")
 
         # Get meme prompts from OpenAI
         try:
             marketing_prompts = await self.openai_client.generate_marketing_prompts(
-                item_analysis, base64_image
+                item_analysis, original_image
             )
             print(f"[DEBUG] Generated {len(marketing_prompts)} marketing prompts")
         except Exception as e:
@@ -439,44 +485,31 @@ Make it ABSURDLY specific and viral-worthy!"""
                 },
             ]
 
+        # Compress and encode the source once for every marketing image
+        prepared_source = await self.bfl_client.prepare_image(original_image)
+
         # Generate all marketing images
         results = []
         errors = []
 
-        # Process in batches of 2
-        for i in range(0, len(marketing_prompts), 2):
-            batch = marketing_prompts[i : i + 2]
-            batch_tasks = []
-
-            for prompt_data in batch:
-                # Create a structured prompt for the image generator
-                full_prompt_data = {
-                    "type": f"marketing_{prompt_data['style'].replace('/', '_').replace(' ', '_')}",
-                    "description": prompt_data["title"],
-                    "prompt": prompt_data["prompt"],
-                    "priority": "high",
-                }
+        # Submit everything at once; the shared BFL limiter paces submissions
+        tasks = []
+        for prompt_data in marketing_prompts:
+            # Create a structured prompt for the image generator
+            full_prompt_data = {
+                "type": f"marketing_{prompt_data['style'].replace('/', '_').replace(' ', '_')}",
+                "description": prompt_data["title"],
+                "prompt": prompt_data["prompt"],
+                "priority": "high",
+            }
+            tasks.append(generate_and_report(prompt_data, full_prompt_data))
 
-                task = self._generate_single_image(
-                    original_image, full_prompt_data, item_analysis
-                )
-                batch_tasks.append(task)
-
-            # Execute batch
-            batch_results = await asyncio.gather(*batch_tasks, return_exceptions=True)
-
-            for j, result in enumerate(batch_results):
-                if isinstance(result, Exception):
-                    errors.append(str(result))
-                    print(f"[DEBUG] Error generating marketing image: {str(result)}")
-                else:
-                    # Add the meme title to the result
-                    result["meme_title"] = batch[j]["title"]
-                    results.append(result)
-
-            # Delay between batches
-            if i + 2 < len(marketing_prompts):
-                await asyncio.sleep(2)
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                errors.append(str(result))
+                print(f"[DEBUG] Error generating marketing image: {str(result)}")
+            else:
+                results.append(result)
 
         return {
             "mode": "marketing",
@@ -0,0 +1,178 @@
+from typing import Dict, Any, Optional, Type, TypeVar, Callable
+from pydantic import BaseModel, ValidationError
+from app.config import settings
+from services.incremental_json import IncrementalJSONParser
+from services.openai_scheduler import scheduled, PRIORITY_STANDARD
+
+T = TypeVar("T", bound=BaseModel)
+
+# Called with (key, value) for each top-level field of a streamed reply
+FieldCallback = Callable[[str, Any], None]
+
+
+class StructuredOutputError(Exception):
+    """The model's reply didn't match the expected schema, even after repair."""
+
+
+def _make_strict(node: Any):
+    if isinstance(node, list):
+        for item in node:
+            _make_strict(item)
+        return
+    if not isinstance(node, dict):
+        return
+
+    node.pop("title", None)
+    node.pop("default", None)
+
+    properties = node.get("properties")
+    if properties is not None:
+        # Strict mode: every property listed as required, nothing extra allowed
+        node["required"] = list(properties)
+        node["additionalProperties"] = False
+        for prop in properties.values():
+            _make_strict(prop)
+
+    for definition in node.get("$defs", {}).values():
+        _make_strict(definition)
+    _make_strict(node.get("items"))
+    _make_strict(node.get("anyOf"))
+
+
+def strict_json_schema(response_model: Type[BaseModel]) -> Dict[str, Any]:
+    """JSON schema for `response_model` in the form strict structured outputs accept."""
+    schema = response_model.model_json_schema()
+    _make_strict(schema)
+    return schema
+
+
+def response_format(name: str, response_model: Type[BaseModel]) -> Dict[str, Any]:
+    """The Responses API `text` parameter constraining output to `response_model`."""
+    return {
+        "format": {
+            "type": "json_schema",
+            "name": name,
+            "schema": strict_json_schema(response_model),
+            "strict": True
+        }
+    }
+
+
+class ParseMetrics:
+    """Per-prompt counts of structured replies parsed, repaired and lost."""
+
+    OUTCOMES = ("parsed", "repaired", "failed")
+
+    def __init__(self):
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def record(self, prompt: str, outcome: str):
+        counts = self._counts.setdefault(prompt, {o: 0 for o in self.OUTCOMES})
+        counts[outcome] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for prompt, counts in self._counts.items():
+            requests = sum(counts.values())
+            result[prompt] = {
+                "requests": requests,
+                **counts,
+                # Replies that needed a repair call or were lost entirely
+                "parse_failure_rate": round((counts["repaired"] + counts["failed"]) / requests, 4),
+                "unrecovered_rate": round(counts["failed"] / requests, 4)
+            }
+        return result
+
+    def reset(self):
+        self._counts.clear()
+
+
+parse_metrics = ParseMetrics()
+
+
+async def _repair(client, name: str, response_model: Type[T], bad_output: str,
+                  error: Exception, max_output_tokens: Optional[int], priority: int) -> T:
+    """One cheap text-only call asking a small model to fix the reply."""
+    request = {
+        "model": settings.openai_repair_model,
+        "instructions": "You fix malformed JSON. Return only the corrected JSON, keeping the original content wherever possible.",
+        "input": f"The following output failed validation.\n\nErrors:\n{error}\n\nOutput:\n{bad_output}",
+        "text": response_format(name, response_model)
+    }
+    if max_output_tokens:
+        request["max_output_tokens"] = max_output_tokens
+    response = await scheduled(client.responses.create, priority, **request)
+    return response_model.model_validate_json(response.output_text)
+
+
+async def _stream_text(client, request: Dict[str, Any], priority: int,
+                       on_field: Optional[FieldCallback],
+                       on_partial: Optional[FieldCallback]) -> str:
+    """Stream the reply, reporting fields as they complete and string values as they grow."""
+    parser = IncrementalJSONParser()
+    chunks = []
+    stream = await scheduled(client.responses.create, priority, stream=True, **request)
+    async for event in stream:
+        if event.type != "response.output_text.delta":
+            continue
+        chunks.append(event.delta)
+        for key, value in parser.feed(event.delta):
+            if on_partial and isinstance(value, str):
+                # The chunk that closed the string may carry its last words,
+                # which partial_value no longer reports: send the final text
+                on_partial(key, value)
+            if on_field:
+                on_field(key, value)
+        if on_partial:
+            partial = parser.partial_value()
+            if partial:
+                on_partial(*partial)
+    return "".join(chunks)
+
+
+async def create_structured(client, name: str, response_model: Type[T],
+                            on_field: Optional[FieldCallback] = None,
+                            on_partial: Optional[FieldCallback] = None,
+                            priority: int = PRIORITY_STANDARD, **request) -> T:
+    """Call the Responses API with output constrained to `response_model`.
+
+    `name` identifies the prompt in parse metrics. A reply that fails
+    validation gets at most one repair attempt with OPENAI_REPAIR_MODEL;
+    if that fails too, StructuredOutputError is raised. Errors from the API
+    call itself propagate unchanged.
+
+    With `on_field` the reply is streamed and `on_field(key, value)` is
+    called for each top-level field as soon as it is complete, before the
+    reply as a whole has been validated. `on_partial(key, text)` likewise
+    receives the text so far of a string field while it is being generated,
+    and its final text once complete (just before `on_field`).
+
+    Calls (including the repair) go through the shared OpenAI scheduler in
+    the `priority` lane.
+    """
+    request.setdefault("model", settings.openai_model)
+    request["text"] = response_format(name, response_model)
+
+    if on_field is not None or on_partial is not None:
+        result_text = await _stream_text(client, request, priority, on_field, on_partial)
+    else:
+        response = await scheduled(client.responses.create, priority, **request)
+        result_text = response.output_text
+
+    try:
+        parsed = response_model.model_validate_json(result_text)
+    except (ValidationError, ValueError) as e:
+        print(f"[DEBUG] Structured reply for {name} failed validation, repairing: {str(e)}")
+        try:
+            parsed = await _repair(client, name, response_model, result_text, e,
+                                   request.get("max_output_tokens"), priority)
+        except Exception as repair_error:
+            parse_metrics.record(name, "failed")
+            raise StructuredOutputError(
+                f"Unparseable {name} reply: {str(repair_error)}"
+            ) from repair_error
+        parse_metrics.record(name, "repaired")
+        return parsed
+
+    parse_metrics.record(name, "parsed")
+    return parsed
@@ -0,0 +1,89 @@
+import base64
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Dict, Any, Optional, Union, BinaryIO
+from PIL import Image, ImageOps
+from app.config import settings
+
+
+# An image as a local path, raw bytes or a binary file-like object
+ImageInput = Union[str, bytes, bytearray, memoryview, BinaryIO]
+
+
+def read_image_bytes(image: ImageInput) -> bytes:
+    """Return the raw bytes of an image given as a path, bytes or buffer."""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return bytes(image)
+    if isinstance(image, str):
+        with open(image, "rb") as image_file:
+            return image_file.read()
+    if hasattr(image, "seek"):
+        image.seek(0)
+    return image.read()
+
+
+@dataclass(frozen=True)
+class VisionImage:
+    """An LLM-sized derivative of an upload, ready to embed in a prompt."""
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    detail: str
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{base64.b64encode(self.data).decode('utf-8')}"
+
+    def input_part(self) -> Dict[str, Any]:
+        """Responses-API input part embedding this image inline."""
+        return {
+            "type": "input_image",
+            "image_url": self.data_url,
+            "detail": self.detail
+        }
+
+
+def preprocess_for_vision(image: ImageInput,
+                          max_edge: Optional[int] = None,
+                          detail: Optional[str] = None,
+                          image_format: Optional[str] = None,
+                          quality: Optional[int] = None) -> VisionImage:
+    """Decode once, apply EXIF orientation and re-encode at vision-model size.
+
+    The model downsamples large images anyway, so sending the original only
+    costs upload time and tokens. Defaults come from the VISION_* settings.
+    """
+    max_edge = max_edge or settings.vision_max_edge
+    detail = detail or settings.vision_detail
+    image_format = (image_format or settings.vision_format).lower()
+    quality = quality or settings.vision_quality
+
+    img = ImageOps.exif_transpose(Image.open(BytesIO(read_image_bytes(image))))
+
+    # Flatten transparency onto white; JPEG has no alpha channel
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        img = background
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+    output = BytesIO()
+    if image_format == "webp":
+        img.save(output, format='WEBP', quality=quality)
+        mime_type = "image/webp"
+    else:
+        img.save(output, format='JPEG', quality=quality, optimize=True)
+        mime_type = "image/jpeg"
+
+    return VisionImage(
+        data=output.getvalue(),
+        mime_type=mime_type,
+        width=img.width,
+        height=img.height,
+        detail=detail
+    )
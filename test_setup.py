@@ -71,13 +71,18 @@ def test_database():
     """Test database connection."""
     print("\nTesting database connection...")
     try:
-        from app.database import SessionLocal, init_db
+        from sqlalchemy import select, func
+        from app.database import SessionLocal, init_db, close_db
         from app.models import Listing
         
-        init_db()
-        db = SessionLocal()
-        count = db.query(Listing).count()
-        db.close()
+        async def count_listings():
+            await init_db()
+            async with SessionLocal() as db:
+                count = await db.scalar(select(func.count()).select_from(Listing))
+            await close_db()
+            return count
+        
+        count = asyncio.run(count_listings())
         
         print(f"✅ Database: Connected successfully ({count} listings)")
         return True